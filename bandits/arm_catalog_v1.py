@@ -0,0 +1,140 @@
+import bandits.bandit_helper_v1 as bandit_helper
+
+
+class ArmCatalog:
+    """
+    Keeps the index and MV arms generated for each query template (query id), so arms are only generated again for
+    templates that are new or whose inputs changed, or when some of their arms were evicted from the arm store. The
+    per round values of the arms (query ids and clustered index time) are still rebuilt every round from the queries in
+    the window.
+    """
+
+    def __init__(self, query_properties, subset_index=None):
+        self.query_properties = query_properties
+        self.subset_index = subset_index    # TableSubsetIndex, if the frequent subsets come from the index
+        self.index_arms = {}    # query id -> (predicate signature, index arms)
+        self.mv_arms = {}       # query id -> (table subsets used, MV arms)
+        self.last_seen = {}     # query id -> round
+
+    def get_index_arms(self, connection, query_obj):
+        """
+        Index arms of a query, generated only if the query is new or its predicates changed
+
+        :param connection: SQL connection
+        :param query_obj: Query object
+        :return: dict of index arms
+        """
+        signature = self.get_predicate_signature(query_obj)
+        if query_obj.id not in self.index_arms or self.index_arms[query_obj.id][0] != signature or \
+                not self.in_arm_store(self.index_arms[query_obj.id][1]):
+            bandit_arms = bandit_helper.gen_arms_from_predicates_v2(connection, query_obj, self.query_properties)
+            self.index_arms[query_obj.id] = (signature, bandit_arms)
+        return self.index_arms[query_obj.id][1]
+
+    def get_mv_arms(self, connection, query_obj, tables, frequent_table_subsets):
+        """
+        MV arms of a query. MV arms depend on the frequent table subsets of the round, so they are generated again
+        only when the set of frequent subsets that apply to this query changes
+
+        :param connection: SQL connection
+        :param query_obj: Query object
+        :param tables: tables in the database
+        :param frequent_table_subsets: frequent table subsets of the current window
+        :return: dict of MV arms
+        """
+        if self.subset_index is not None:
+            # only the subsets of this query are looked at, not all the frequent subsets of the window
+            frequent_table_subsets = self.subset_index.get_frequent_query_subsets(query_obj.id)
+            used_subsets = frozenset(frequent_table_subsets)
+        else:
+            query_tables = set(self.query_properties['tables'][query_obj.id])
+            query_joins = self.query_properties['joins'][query_obj.id]
+            used_subsets = frozenset(table_subset for table_subset in frequent_table_subsets
+                                     if set(table_subset).issubset(query_tables) and
+                                     bandit_helper.can_be_joined(table_subset, query_joins))
+        if query_obj.id not in self.mv_arms or self.mv_arms[query_obj.id][0] != used_subsets or \
+                not self.in_arm_store(self.mv_arms[query_obj.id][1]):
+            bandit_arms = bandit_helper.gen_mv_arms_from_predicates_v3(connection, query_obj, tables,
+                                                                       frequent_table_subsets, self.query_properties,
+                                                                       True)
+            self.mv_arms[query_obj.id] = (used_subsets, bandit_arms)
+        return self.mv_arms[query_obj.id][1]
+
+    def get_round_arms(self, connection, query_objs, tables, frequent_table_subsets, with_mv):
+        """
+        Collects the arms of all queries in the window, grouped by table (MV arms are under their own table name),
+        and sets the query ids and clustered index time of each arm for this round
+
+        :param connection: SQL connection
+        :param query_objs: queries in the current window
+        :param tables: tables in the database
+        :param frequent_table_subsets: frequent table subsets of the current window
+        :param with_mv: generate MV arms
+        :return: dict of dicts, table name -> arm id -> arm
+        """
+        arm_store = bandit_helper.bandit_arm_store
+        for query_id in [query_id for query_id, last_seen in self.last_seen.items()
+                         if 0 < arm_store.max_age < arm_store.current_round - last_seen]:
+            # the arms of this template were already evicted from the arm store
+            self.index_arms.pop(query_id, None)
+            self.mv_arms.pop(query_id, None)
+            del self.last_seen[query_id]
+
+        index_arms = {}
+        for query_obj in query_objs:
+            self.last_seen[query_obj.id] = arm_store.current_round
+            for key, index_arm in self.get_index_arms(connection, query_obj).items():
+                table_arms = self.add_round_arm(index_arms, key, index_arm, query_obj.id)
+                table_arms[key].clustered_index_time += query_obj.original_running_time
+
+            if with_mv:
+                mv_arms = self.get_mv_arms(connection, query_obj, tables, frequent_table_subsets)
+                for key, index_arm in mv_arms.items():
+                    table_arms = self.add_round_arm(index_arms, key, index_arm, query_obj.id)
+                    for ta in index_arm.table_names:
+                        table_arms[key].clustered_index_time += max(query_obj.table_scan_times[ta]) if \
+                            query_obj.table_scan_times[ta] else 0
+        return index_arms
+
+    @staticmethod
+    def add_round_arm(index_arms, key, index_arm, query_id):
+        """
+        Adds an arm to the arms of this round, the per round values are reset the first time the arm is seen
+
+        :param index_arms: arms of this round, table name -> arm id -> arm
+        :param key: arm id
+        :param index_arm: bandit arm
+        :param query_id: query that generated the arm
+        :return: arms of the table of the arm
+        """
+        bandit_helper.bandit_arm_store.touch(key)
+        table_arms = index_arms.setdefault(index_arm.table_name, {})
+        if key not in table_arms:
+            index_arm.query_ids = set()
+            index_arm.query_ids_backup = set()
+            index_arm.clustered_index_time = 1
+            table_arms[key] = index_arm
+        table_arms[key].query_ids.add(query_id)
+        table_arms[key].query_ids_backup.add(query_id)
+        return table_arms
+
+    @staticmethod
+    def in_arm_store(bandit_arms):
+        """
+        Checks if all the cached arms are still in the arm store, evicted arms are created again by the generators
+
+        :param bandit_arms: dict of arms
+        :return: True if none of the arms were evicted
+        """
+        return all(arm_id in bandit_helper.bandit_arm_store for arm_id in bandit_arms)
+
+    @staticmethod
+    def get_predicate_signature(query_obj):
+        """
+        Everything in a query that index arm generation depends on
+
+        :param query_obj: Query object
+        :return: hashable signature
+        """
+        return (tuple((table_name, tuple(columns)) for table_name, columns in query_obj.predicates.items()),
+                tuple((table_name, tuple(columns)) for table_name, columns in query_obj.payload.items()))
@@ -1,12 +1,21 @@
+from bandits.bandit_arm_v1 import get_arm_index, intern_columns
+
+
 class BanditArmMV:
+    __slots__ = ('schema_name', 'table_names', 'table_name', 'payload', 'join_cols', 'index_name', 'arm_index',
+                 'memory', 'name_encoded_context', 'index_usage_last_batch', 'query_id', 'query_ids',
+                 'query_ids_backup', 'clustered_index_time', 'creation_query', 'view_query', 'index_query', 'group_by',
+                 'filter_by', 'bandit_cluster', 'group_by_columns', 'view_query_comps', 'index_query_comps')
+
     def __init__(self, query_id, payload, join_cols, table_names, group_by_columns):
         group_by = True if group_by_columns else False
         self.schema_name = 'dbo'
-        self.table_names = table_names
+        self.table_names = intern_columns(table_names)
         self.table_name = 'MV'
         self.payload = payload
         self.join_cols = join_cols
         self.index_name = self.get_arm_id(query_id, table_names, group_by)
+        self.arm_index = get_arm_index(self.index_name)
         self.memory = None
         self.name_encoded_context = []
         self.index_usage_last_batch = 0
@@ -25,10 +34,10 @@ class BanditArmMV:
         self.index_query_comps = None
 
     def __eq__(self, other):
-        return self.index_name == other.index_name
+        return self.arm_index == other.arm_index
 
     def __hash__(self):
-        return hash(self.index_name)
+        return self.arm_index
 
     def __le__(self, other):
         if len(self.payload) > len(other.payload):
@@ -0,0 +1,145 @@
+import collections
+import logging
+import sys
+
+import scipy.sparse
+
+import bandits.bandit_arm_v1 as bandit_arm
+import constants
+
+
+class BanditArmStore:
+    """
+    Store of all generated index and MV arms, keyed by arm id. Works like the dict it replaces, but it remembers the
+    round each arm was last used and evicts arms that have not been used for max_age rounds, or the least recently
+    used arms while the store is over its memory cap. Arms used in the current round are never evicted. Evicted arms
+    are also released from the arm name registry and the interned column tuples, so both stay as small as the store.
+    """
+
+    def __init__(self, max_age=constants.ARM_STORE_MAX_AGE, max_memory=constants.ARM_STORE_MAX_MEMORY):
+        self.arms = collections.OrderedDict()     # least recently used first
+        self.last_used = {}
+        self.arm_keys = collections.defaultdict(set)  # arm_index -> store keys of the arms with that id
+        self.max_age = max_age
+        self.max_memory = max_memory
+        self.current_round = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, arm_id):
+        return arm_id in self.arms
+
+    def __getitem__(self, arm_id):
+        arm = self.arms[arm_id]
+        self.hits += 1
+        self.touch(arm_id)
+        return arm
+
+    def __setitem__(self, arm_id, arm):
+        if arm_id not in self.arms:
+            self.misses += 1
+        else:
+            self.release_key(self.arms[arm_id], arm_id)
+        self.arm_keys[arm.arm_index].add(arm_id)
+        self.arms[arm_id] = arm
+        self.touch(arm_id)
+
+    def __len__(self):
+        return len(self.arms)
+
+    def items(self):
+        return self.arms.items()
+
+    def values(self):
+        return self.arms.values()
+
+    def touch(self, arm_id):
+        """
+        Marks the arm as used in the current round
+
+        :param arm_id: arm id
+        """
+        if arm_id in self.arms:
+            self.arms.move_to_end(arm_id)
+            self.last_used[arm_id] = self.current_round
+
+    def start_round(self, current_round, kept_arm_indexes=()):
+        """
+        Moves the store to a new round and evicts arms that are too old, then least recently used arms until the
+        store fits in the memory cap
+
+        :param current_round: current round number
+        :param kept_arm_indexes: arm_index of the arms that are never evicted this round (the arms created in the
+            database), every store key of these arms is kept
+        """
+        self.current_round = current_round
+        for arm_index in kept_arm_indexes:
+            for arm_id in self.arm_keys.get(arm_index, ()):
+                self.touch(arm_id)
+        evictions = self.evictions
+        while self.arms and self.max_age > 0:
+            arm_id = next(iter(self.arms))
+            if current_round - self.last_used[arm_id] <= self.max_age:
+                break
+            self.evict(arm_id)
+
+        memory = self.get_memory()
+        while self.arms and self.max_memory > 0 and memory > self.max_memory:
+            arm_id = next(iter(self.arms))
+            if self.last_used[arm_id] >= current_round:
+                break
+            memory -= self.get_arm_memory(self.arms[arm_id])
+            self.evict(arm_id)
+        if self.evictions > evictions:
+            bandit_arm.reset_interned_columns(self.arms.values())
+        logging.info(f"Arm store: {len(self.arms)} arms, {memory:.2f}MB, hits: {self.hits}, misses: {self.misses}, "
+                     f"evictions: {self.evictions}")
+
+    def evict(self, arm_id):
+        """
+        Removes an arm from the store
+
+        :param arm_id: arm id
+        """
+        self.release_key(self.arms.pop(arm_id), arm_id)
+        del self.last_used[arm_id]
+        self.evictions += 1
+
+    def release_key(self, arm, arm_id):
+        """
+        Removes a store key of the arm, and releases the arm name from the name registry once no arm in the store
+        uses it
+
+        :param arm: bandit arm
+        :param arm_id: store key of the arm
+        """
+        arm_keys = self.arm_keys[arm.arm_index]
+        arm_keys.discard(arm_id)
+        if not arm_keys:
+            del self.arm_keys[arm.arm_index]
+            bandit_arm.release_arm_index(arm.index_name)
+
+    def get_memory(self):
+        """
+        Approximate memory used by the arms in the store
+
+        :return: memory in MB
+        """
+        return sum(self.get_arm_memory(arm) for arm in self.arms.values())
+
+    @staticmethod
+    def get_arm_memory(arm):
+        """
+        Approximate memory used by an arm (slotted object) plus the cached context
+
+        :param arm: bandit arm
+        :return: memory in MB
+        """
+        memory = sys.getsizeof(arm)
+        context = arm.name_encoded_context
+        if scipy.sparse.issparse(context):
+            memory += context.data.nbytes + context.indices.nbytes + context.indptr.nbytes
+        elif hasattr(context, 'nbytes'):
+            memory += context.nbytes
+        return memory / (1024 * 1024)
@@ -1,9 +1,77 @@
+arm_indexes = {}         # arm name -> integer id of the arms in the arm store, names are only needed in the DB
+interned_columns = {}
+next_arm_index = 0
+
+
+def get_arm_index(index_name):
+    """
+    Integer id of an arm name, the same name gets the same id while the arm is in the arm store. Ids of released arms
+    are not reused, an evicted arm can still be referenced until the end of the round
+
+    :param index_name: name of the index or view
+    :return: integer id
+    """
+    global next_arm_index
+    if index_name not in arm_indexes:
+        arm_indexes[index_name] = next_arm_index
+        next_arm_index += 1
+    return arm_indexes[index_name]
+
+
+def release_arm_index(index_name):
+    """
+    Removes an evicted arm from the name registry
+
+    :param index_name: name of the index or view
+    """
+    arm_indexes.pop(index_name, None)
+
+
+def restore_arm_indexes(saved_arm_indexes):
+    """
+    Restores the name registry saved in a checkpoint
+
+    :param saved_arm_indexes: arm name -> integer id
+    """
+    global next_arm_index
+    arm_indexes.update(saved_arm_indexes)
+    next_arm_index = max(next_arm_index, max(arm_indexes.values(), default=-1) + 1)
+
+
+def intern_columns(columns):
+    """
+    Returns a shared tuple for a column list, so arms with the same columns share one tuple
+
+    :param columns: column names
+    :return: column tuple
+    """
+    columns = tuple(columns)
+    return interned_columns.setdefault(columns, columns)
+
+
+def reset_interned_columns(arms):
+    """
+    Keeps only the column tuples used by the given arms, so tuples of evicted arms can be freed
+
+    :param arms: arms that are kept (index and MV arms)
+    """
+    interned_columns.clear()
+    for arm in arms:
+        for columns in (getattr(arm, 'index_cols', ()), getattr(arm, 'include_cols', ()),
+                        getattr(arm, 'table_names', ())):
+            interned_columns.setdefault(columns, columns)
+
+
 class BanditArm:
+    __slots__ = ('schema_name', 'table_name', 'index_cols', 'include_cols', 'index_name', 'arm_index', 'memory',
+                 'table_row_count', 'name_encoded_context', 'index_usage_last_batch', 'cluster', 'query_id',
+                 'query_ids', 'query_ids_backup', 'is_include', 'clustered_index_time', 'bandit_cluster')
+
     def __init__(self, index_cols, table_name, memory, table_row_count, include_cols=()):
         self.schema_name = 'dbo'
         self.table_name = table_name
-        self.index_cols = index_cols
-        self.include_cols = include_cols
+        self.index_cols = intern_columns(index_cols)
+        self.include_cols = intern_columns(include_cols)
         if self.include_cols:
             # include_col_hash = hashlib.sha1('_'.join(include_cols).lower().encode()).hexdigest()
             include_col_names = '_'.join(tuple(map(lambda x: x[0:4], include_cols))).lower()
@@ -11,6 +79,7 @@ class BanditArm:
         else:
             self.index_name = 'ix_' + table_name + '_' + '_'.join(index_cols).lower()
         self.index_name = self.index_name[:127]
+        self.arm_index = get_arm_index(self.index_name)
         self.memory = memory
         self.table_row_count = table_row_count
         self.name_encoded_context = []
@@ -25,19 +94,13 @@ class BanditArm:
         self.bandit_cluster = None
 
     def __eq__(self, other):
-        return self.index_name == other.index_name
+        return self.arm_index == other.arm_index
 
     def __hash__(self):
-        return hash(self.index_name)
+        return self.arm_index
 
     def __le__(self, other):
-        if len(self.index_cols) > len(other.index_cols):
-            return False
-        else:
-            for i in range(len(self.index_cols)):
-                if self.index_cols[i] != other.index_cols[i]:
-                    return False
-            return True
+        return other.index_cols[:len(self.index_cols)] == self.index_cols
 
     def __str__(self):
         return self.index_name
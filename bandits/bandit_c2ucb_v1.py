@@ -1,9 +1,12 @@
+import collections
 import copy
 import logging
 from abc import abstractmethod
 from bandits.bandit_helper_v1 import Reward
 
 import numpy
+import scipy.linalg
+import scipy.sparse
 
 import constants
 
@@ -16,6 +19,7 @@ class C3UCBBaseBandit:
         self.hyper_alpha = hyper_alpha
         self.hyper_lambda = hyper_lambda        # lambda in C2CUB
         self.v = hyper_lambda * numpy.identity(context_size)    # identity matrix of n*n
+        self.v_inverse = (1 / hyper_lambda) * numpy.identity(context_size)  # kept in sync with v on every update
         self.b = numpy.zeros((context_size, 1))  # [0, 0, ..., 0]T (column matrix) size = number of arms
         self.oracle = oracle
         self.context_vectors = []
@@ -31,6 +35,89 @@ class C3UCBBaseBandit:
     def update(self, played_arms, arm_rewards, useless, mv_size_weight, index_size_weight):
         pass
 
+    def rank_k_update(self, context_matrix, rewards, sign=1):
+        """
+        Adds X^T X to V and X^T r to b for all played contexts at once. V inverse is updated with the Woodbury
+        identity, so only a k x k system is solved instead of inverting V from scratch when selecting arms
+
+        :param context_matrix: (k x context size) matrix, one row per played context
+        :param rewards: numpy array of k rewards
+        :param sign: 1 to add the contexts, -1 to remove contexts that were added before
+        """
+        if context_matrix.shape[0] == 0:
+            return
+        context_matrix_t = context_matrix.transpose()
+        self.v += sign * (context_matrix_t @ context_matrix)
+        self.b += sign * (context_matrix_t @ rewards).reshape(-1, 1)
+        if context_matrix.shape[0] >= self.context_size:
+            self.refresh_v_inverse()
+        else:
+            v_inverse_xt = self.v_inverse @ context_matrix_t
+            capacitance = sign * numpy.identity(context_matrix.shape[0]) + context_matrix @ v_inverse_xt
+            self.v_inverse -= v_inverse_xt @ numpy.linalg.solve(capacitance, v_inverse_xt.transpose())
+
+    def refresh_v_inverse(self):
+        """
+        Recomputes V inverse from V, only needed when V is changed by something other than a rank k update
+        """
+        self.v_inverse = numpy.linalg.inv(self.v)
+
+    def get_weight_vector(self):
+        """
+        Current estimate of the weight vector, V^-1 b
+
+        :return: weight vector (column matrix)
+        """
+        return self.v_inverse @ self.b
+
+    def get_state(self):
+        """
+        Returns the learned state of the bandit as numpy arrays, used for checkpoints
+
+        :return: dictionary of numpy arrays
+        """
+        return {'v': self.v, 'v_inverse': self.v_inverse, 'b': self.b, 'hyper_alpha': numpy.array(self.hyper_alpha)}
+
+    def set_state(self, state):
+        """
+        Restores the learned state of the bandit from a checkpoint
+
+        :param state: dictionary of numpy arrays created by get_state
+        """
+        self.v = numpy.array(state['v'], dtype=float)
+        self.v_inverse = numpy.array(state['v_inverse'], dtype=float)
+        self.b = numpy.array(state['b'], dtype=float)
+        self.hyper_alpha = float(state['hyper_alpha'])
+
+    def get_context_matrix(self, context_vectors):
+        """
+        Stacks the column context vectors of a round in to a single (number of arms x context size) matrix
+
+        :param context_vectors: list of column context vectors or an already stacked matrix
+        :return: context matrix, one row per arm
+        """
+        if isinstance(context_vectors, numpy.ndarray):
+            return context_vectors
+        if len(context_vectors) == 0:
+            return numpy.zeros((0, self.context_size))
+        return numpy.hstack(context_vectors).transpose()
+
+    def get_upper_bounds(self, context_matrix, weight_vector, creation_cost_columns):
+        """
+        Calculates the upper confidence bound of every arm at once. Mean reward and creation cost are matrix vector
+        products and the confidence width is a row wise quadratic form over V inverse
+
+        :param context_matrix: (number of arms x context size) matrix
+        :param weight_vector: current estimate of the weight vector (column matrix)
+        :param creation_cost_columns: context positions that carry the creation cost
+        :return: numpy array of upper bounds, one per arm
+        """
+        weights = weight_vector[:, 0]
+        creation_cost = context_matrix[:, creation_cost_columns] @ weights[creation_cost_columns]
+        average_reward = context_matrix @ weights - creation_cost
+        confidence = numpy.sqrt(numpy.einsum('ij,ij->i', context_matrix @ self.v_inverse, context_matrix))
+        return average_reward + self.hyper_alpha * confidence + creation_cost / constants.CREATION_COST_REDUCTION_FACTOR
+
 
 class C3UCB(C3UCBBaseBandit):
 
@@ -42,23 +129,25 @@ class C3UCB(C3UCBBaseBandit):
         :param current_round: current round number
         :return: selected set of arms
         """
-        v_inverse = numpy.linalg.inv(self.v)
-        weight_vector = v_inverse @ self.b
+        weight_vector = self.get_weight_vector()
         logging.info(f"================================\n{weight_vector.transpose().tolist()[0]}")
-        self.context_vectors = context_vectors
+        self.context_vectors = self.get_context_matrix(context_vectors)
 
         # find the upper bound for every arm
-        for i in range(len(self.arms)):
-            creation_cost = weight_vector[1] * self.context_vectors[i][1]
-            average_reward = numpy.asscalar(weight_vector.transpose() @ self.context_vectors[i]) - creation_cost
-            temp_upper_bound = average_reward + self.hyper_alpha * numpy.sqrt(
-                numpy.asscalar(self.context_vectors[i].transpose() @ v_inverse @ self.context_vectors[i]))
-            temp_upper_bound = temp_upper_bound + (creation_cost / constants.CREATION_COST_REDUCTION_FACTOR)
-            self.upper_bounds.append(temp_upper_bound)
+        self.upper_bounds = self.get_upper_bounds(self.context_vectors, weight_vector, [1])
 
         logging.debug(self.upper_bounds)
         return self.oracle.get_super_arm(self.upper_bounds, self.context_vectors, self.arms)
 
+    def get_arm_upper_bounds(self, context_vectors):
+        """
+        Upper bounds of the given arms without running the oracle, used to find the arms that can reach the oracle
+
+        :param context_vectors: context vectors of the arms
+        :return: numpy array of upper bounds, one per arm
+        """
+        return self.get_upper_bounds(self.get_context_matrix(context_vectors), self.get_weight_vector(), [1])
+
     def select_super_arm_v2(self, context_vectors):
         """
         This method is responsible for returning the super arm
@@ -66,19 +155,12 @@ class C3UCB(C3UCBBaseBandit):
         :param context_vectors: context vector for this round
         :return: selected set of arms
         """
-        v_inverse = numpy.linalg.inv(self.v)
-        weight_vector = v_inverse @ self.b
+        weight_vector = self.get_weight_vector()
         logging.info(f"================================\n{weight_vector.transpose().tolist()[0]}")
-        self.context_vectors = context_vectors
+        self.context_vectors = self.get_context_matrix(context_vectors)
 
         # find the upper bound for every arm
-        for i in range(len(self.arms)):
-            creation_cost = (weight_vector[1] * self.context_vectors[i][1]) + (weight_vector[0] * self.context_vectors[i][0])
-            average_reward = numpy.asscalar(weight_vector.transpose() @ self.context_vectors[i]) - creation_cost
-            temp_upper_bound = average_reward + self.hyper_alpha * numpy.sqrt(
-                numpy.asscalar(self.context_vectors[i].transpose() @ v_inverse @ self.context_vectors[i]))
-            temp_upper_bound = temp_upper_bound + (creation_cost / constants.CREATION_COST_REDUCTION_FACTOR)
-            self.upper_bounds.append(temp_upper_bound)
+        self.upper_bounds = self.get_upper_bounds(self.context_vectors, weight_vector, [0, 1])
 
         self.hyper_alpha = self.hyper_alpha / constants.ALPHA_REDUCTION_RATE
         return self.oracle.get_super_arm(self.upper_bounds, self.context_vectors, self.arms), weight_vector[0], weight_vector[1]
@@ -93,24 +175,35 @@ class C3UCB(C3UCBBaseBandit):
         mod_arm_reward.offset = mod_arm_reward.offset / arm_mem
         return mod_arm_reward
 
-    def update(self, played_arms, arm_rewards, useless, mv_size_weight, index_size_weight):
+    def get_update_batch(self, played_arms, arm_rewards, useless, mv_size_weight, index_size_weight, is_super=False):
         """
-        This method can be used to update the reward after each play (improvements required)
+        Collects the contexts and rewards of all played arms so they can be applied as a single rank k update.
+        The size (creation cost) part of each context is split in to its own row, which gets the creation reward
 
         :param played_arms: list of played arms (super arm)
         :param arm_rewards: tuple (gains, creation cost) reward got form playing each arm
+        :param useless: arm_index of the arms removed after the hypothetical check
+        :param mv_size_weight: current weight of the MV size context in the super bandit
+        :param index_size_weight: current weight of the index size context in the super bandit
+        :param is_super: True for the super bandit, where MV arms carry their size in position 0
+        :return: context matrix (rows x context size), numpy array of rewards
         """
-        for i in played_arms:
-            is_useless = self.arms[i].index_name in useless
-            if self.arms[i].index_name in arm_rewards:
-                arm_reward_original = arm_rewards[self.arms[i].index_name]
-                arm_reward_modified = self.convert_reward(arm_rewards[self.arms[i].index_name], self.arms[i].memory)
+        execution_rewards = []
+        size_columns = []
+        size_rows = []
+        size_values = []
+        size_rewards = []
+        for row, i in enumerate(played_arms):
+            is_useless = self.arms[i].arm_index in useless
+            if self.arms[i].arm_index in arm_rewards:
+                arm_reward_original = arm_rewards[self.arms[i].arm_index]
+                arm_reward_modified = self.convert_reward(arm_rewards[self.arms[i].arm_index], self.arms[i].memory)
                 arm_reward = arm_reward_modified
             else:
                 arm_reward = Reward()
                 arm_reward_original = arm_reward
                 arm_reward_modified = arm_reward
-            logging.info(f"[Useless?{is_useless}]Reward for {self.arms[i].index_name}, {arm_reward.queries} "
+            logging.info(f"[Useless?{is_useless}]{' Super ' if is_super else ''}Reward for {self.arms[i].index_name}, {arm_reward.queries} "
                          f"is: (e, m, c, o) - "
                          f"({round(arm_reward_original.execution, 2)}, {round(arm_reward_original.maintenance, 2)}, {round(arm_reward_original.creation, 2)}, {round(arm_reward_original.offset, 2)})"
                          f"({round(arm_reward_modified.execution, 2)}, {round(arm_reward_modified.maintenance, 2)}, {round(arm_reward_modified.creation, 2)}, {round(arm_reward_modified.offset, 2)})")
@@ -118,22 +211,53 @@ class C3UCB(C3UCBBaseBandit):
             if constants.UNCLAIMED_REWARD_DISTRIBUTION:
                 execution_reward += arm_reward.offset
             self.arms[i].index_usage_last_batch = (self.arms[i].index_usage_last_batch + execution_reward) / 2
+            execution_rewards.append(execution_reward)
 
-            temp_context = numpy.zeros(self.context_vectors[i].shape)
-            temp_context[1] = self.context_vectors[i][1]
-            self.context_vectors[i][1] = 0
-
-            self.v = self.v + (self.context_vectors[i] @ self.context_vectors[i].transpose())
-            self.b = self.b + self.context_vectors[i] * execution_reward
+            is_mv = type(self.arms[i]).__name__ == 'BanditArmMV'
+            size_context = 0 if (is_super and is_mv) else 1
+            size_value = self.context_vectors[i, size_context]
+            size_columns.append(size_context)
             if not is_useless:
-                self.v = self.v + (temp_context @ temp_context.transpose())
-                self.b = self.b + temp_context * arm_reward.creation
+                size_rows.append(row)
+                size_values.append(size_value)
+                size_rewards.append(arm_reward.creation)
             else:
-                if type(self.arms[i]).__name__ == 'BanditArmMV' and mv_size_weight < 10 and index_size_weight != 0 :
-                    self.v = self.v + (temp_context @ temp_context.transpose())
-                    self.b = self.b + temp_context * (temp_context[1] * index_size_weight)
+                if is_mv and mv_size_weight < 10 and index_size_weight != 0:
+                    size_rows.append(row)
+                    size_values.append(size_value)
+                    size_rewards.append(size_value * index_size_weight)
+
+        context_matrix = self.get_update_matrix(played_arms, size_columns, size_rows, size_values)
+        rewards = numpy.hstack(execution_rewards + size_rewards)
+        return context_matrix, rewards
+
+    def get_update_matrix(self, played_arms, size_columns, size_rows, size_values):
+        """
+        Stacks the execution contexts of the played arms (size removed) and the size only contexts
+
+        :param played_arms: list of played arms (super arm)
+        :param size_columns: size context position for each played arm
+        :param size_rows: played arm rows that get a size update
+        :param size_values: size context value for each of the size rows
+        :return: context matrix (rows x context size)
+        """
+        execution_contexts = self.context_vectors[played_arms]
+        execution_contexts[numpy.arange(len(played_arms)), size_columns] = 0
+        size_contexts = numpy.zeros((len(size_rows), self.context_size))
+        size_contexts[numpy.arange(len(size_rows)), numpy.array(size_columns, dtype=int)[size_rows]] = size_values
+        return numpy.vstack((execution_contexts, size_contexts))
 
+    def update(self, played_arms, arm_rewards, useless, mv_size_weight, index_size_weight):
+        """
+        This method can be used to update the reward after each play (improvements required)
+
+        :param played_arms: list of played arms (super arm)
+        :param arm_rewards: tuple (gains, creation cost) reward got form playing each arm
+        """
         if played_arms:
+            context_matrix, rewards = self.get_update_batch(played_arms, arm_rewards, useless, mv_size_weight,
+                                                            index_size_weight)
+            self.rank_k_update(context_matrix, rewards)
             self.hyper_alpha = self.hyper_alpha / constants.ALPHA_REDUCTION_RATE
 
         self.context_vectors = []
@@ -146,43 +270,10 @@ class C3UCB(C3UCBBaseBandit):
         :param played_arms: list of played arms (super arm)
         :param arm_rewards: tuple (gains, creation cost) reward got form playing each arm
         """
-        for i in played_arms:
-            is_useless = self.arms[i].index_name in useless
-            if self.arms[i].index_name in arm_rewards:
-                arm_reward_original = arm_rewards[self.arms[i].index_name]
-                arm_reward_modified = self.convert_reward(arm_rewards[self.arms[i].index_name], self.arms[i].memory)
-                arm_reward = arm_reward_modified
-            else:
-                arm_reward = Reward()
-                arm_reward_original = arm_reward
-                arm_reward_modified = arm_reward
-            logging.info(f"[Useless?{is_useless}] Super Reward for {self.arms[i].index_name}, {arm_reward.queries} "
-                         f"is: (e, m, c, o) - "
-                         f"({round(arm_reward_original.execution, 2)}, {round(arm_reward_original.maintenance, 2)}, {round(arm_reward_original.creation, 2)}, {round(arm_reward_original.offset, 2)})"
-                         f"({round(arm_reward_modified.execution, 2)}, {round(arm_reward_modified.maintenance, 2)}, {round(arm_reward_modified.creation, 2)}, {round(arm_reward_modified.offset, 2)})")
-            execution_reward = arm_reward.execution + arm_reward.maintenance
-            if constants.UNCLAIMED_REWARD_DISTRIBUTION:
-                execution_reward += arm_reward.offset
-            self.arms[i].index_usage_last_batch = (self.arms[i].index_usage_last_batch + execution_reward) / 2
-
-            if type(self.arms[i]).__name__ == 'BanditArmMV':
-                size_context = 0
-            else:
-                size_context = 1
-
-            temp_context = numpy.zeros(self.context_vectors[i].shape)
-            temp_context[size_context] = self.context_vectors[i][size_context]
-            self.context_vectors[i][size_context] = 0
-
-            self.v = self.v + (self.context_vectors[i] @ self.context_vectors[i].transpose())
-            self.b = self.b + self.context_vectors[i] * execution_reward
-            if not is_useless:
-                self.v = self.v + (temp_context @ temp_context.transpose())
-                self.b = self.b + temp_context * arm_reward.creation
-            else:
-                if type(self.arms[i]).__name__ == 'BanditArmMV' and mv_size_weight < 10 and index_size_weight != 0:
-                    self.v = self.v + (temp_context @ temp_context.transpose())
-                    self.b = self.b + temp_context * (temp_context[size_context] * index_size_weight)
+        if played_arms:
+            context_matrix, rewards = self.get_update_batch(played_arms, arm_rewards, useless, mv_size_weight,
+                                                            index_size_weight, is_super=True)
+            self.rank_k_update(context_matrix, rewards)
 
         self.context_vectors = []
         self.upper_bounds = []
@@ -204,6 +295,7 @@ class C3UCB(C3UCBBaseBandit):
         """
         self.hyper_alpha = self.alpha_original
         self.v = self.hyper_lambda * numpy.identity(self.context_size)  # identity matrix of n*n
+        self.v_inverse = (1 / self.hyper_lambda) * numpy.identity(self.context_size)
         self.b = numpy.zeros((self.context_size, 1))  # [0, 0, ..., 0]T (column matrix) size = number of arms
 
     def workload_change_trigger(self, workload_change):
@@ -221,3 +313,538 @@ class C3UCB(C3UCBBaseBandit):
                 self.hyper_alpha = self.alpha_original
             self.v = self.hyper_lambda * numpy.identity(self.context_size) + forget_factor * self.v
             self.b = forget_factor * self.b
+            self.refresh_v_inverse()
+
+
+class C3UCBSparse(C3UCB):
+    """
+    C3UCB for sparse contexts (name encoded index and MV contexts). Contexts are kept as CSR rows, so scoring and
+    updates only touch the non zero entries of each context instead of the full schema width
+    """
+
+    def get_context_matrix(self, context_vectors):
+        """
+        Stacks the sparse context rows of a round in to a single CSR matrix
+
+        :param context_vectors: list of (1 x context size) sparse rows or an already stacked matrix
+        :return: (number of arms x context size) CSR matrix
+        """
+        if scipy.sparse.issparse(context_vectors):
+            return context_vectors.tocsr()
+        if len(context_vectors) == 0:
+            return scipy.sparse.csr_matrix((0, self.context_size))
+        return scipy.sparse.vstack(context_vectors, format='csr')
+
+    def get_quadratic_forms(self, context_matrix):
+        """
+        Calculates x^T V^-1 x for every row using only the pairs of non zero entries within each row
+
+        :param context_matrix: (number of arms x context size) CSR matrix
+        :return: numpy array of quadratic forms, one per arm
+        """
+        context_matrix.sort_indices()
+        row_counts = numpy.diff(context_matrix.indptr)
+        entry_rows = numpy.repeat(numpy.arange(context_matrix.shape[0]), row_counts)
+        entry_counts = row_counts[entry_rows]
+        # pair every non zero entry with all non zero entries of the same row
+        left = numpy.repeat(numpy.arange(len(entry_rows)), entry_counts)
+        pair_offsets = numpy.arange(len(left)) - numpy.repeat(numpy.cumsum(entry_counts) - entry_counts, entry_counts)
+        right = context_matrix.indptr[entry_rows[left]] + pair_offsets
+        indices = context_matrix.indices
+        data = context_matrix.data
+        pair_values = data[left] * data[right] * self.v_inverse[indices[left], indices[right]]
+        return numpy.bincount(entry_rows[left], weights=pair_values, minlength=context_matrix.shape[0])
+
+    def get_upper_bounds(self, context_matrix, weight_vector, creation_cost_columns):
+        """
+        Sparse version of the batched upper bound calculation
+
+        :param context_matrix: (number of arms x context size) CSR matrix
+        :param weight_vector: current estimate of the weight vector (column matrix)
+        :param creation_cost_columns: context positions that carry the creation cost
+        :return: numpy array of upper bounds, one per arm
+        """
+        weights = weight_vector[:, 0]
+        creation_cost = context_matrix[:, creation_cost_columns] @ weights[creation_cost_columns]
+        average_reward = context_matrix @ weights - creation_cost
+        confidence = numpy.sqrt(numpy.maximum(self.get_quadratic_forms(context_matrix), 0))
+        return average_reward + self.hyper_alpha * confidence + creation_cost / constants.CREATION_COST_REDUCTION_FACTOR
+
+    def get_update_matrix(self, played_arms, size_columns, size_rows, size_values):
+        """
+        Sparse version of get_update_matrix, the size entries are moved from the played contexts to their own rows
+
+        :param played_arms: list of played arms (super arm)
+        :param size_columns: size context position for each played arm
+        :param size_rows: played arm rows that get a size update
+        :param size_values: size context value for each of the size rows
+        :return: CSR context matrix (rows x context size)
+        """
+        played_contexts = self.context_vectors[played_arms]
+        played_rows = numpy.arange(len(played_arms))
+        played_sizes = numpy.asarray(played_contexts[played_rows, size_columns]).ravel()
+        execution_contexts = played_contexts - scipy.sparse.csr_matrix(
+            (played_sizes, (played_rows, size_columns)), shape=played_contexts.shape)
+        execution_contexts.eliminate_zeros()
+        size_contexts = scipy.sparse.csr_matrix(
+            (size_values, (numpy.arange(len(size_rows)), numpy.array(size_columns, dtype=int)[size_rows])),
+            shape=(len(size_rows), self.context_size))
+        return scipy.sparse.vstack((execution_contexts, size_contexts), format='csr')
+
+    def rank_k_update(self, context_matrix, rewards, sign=1):
+        """
+        Sparse version of the rank k update. The outer products are added to V entry by entry, and V inverse is
+        updated with Woodbury using sparse products
+
+        :param context_matrix: (k x context size) CSR matrix, one row per played context
+        :param rewards: numpy array of k rewards
+        :param sign: 1 to add the contexts, -1 to remove contexts that were added before
+        """
+        if context_matrix.shape[0] == 0:
+            return
+        context_matrix_t = context_matrix.transpose().tocsr()
+        outer_products = (context_matrix_t @ context_matrix).tocoo()
+        numpy.add.at(self.v, (outer_products.row, outer_products.col), sign * outer_products.data)
+        self.b[:, 0] += sign * (context_matrix_t @ rewards)
+        if context_matrix.shape[0] >= self.context_size:
+            self.refresh_v_inverse()
+        else:
+            x_v_inverse = context_matrix @ self.v_inverse
+            capacitance = sign * numpy.identity(context_matrix.shape[0]) + context_matrix @ x_v_inverse.transpose()
+            self.v_inverse -= x_v_inverse.transpose() @ numpy.linalg.solve(capacitance, x_v_inverse)
+
+
+class C3UCBSlidingWindow(C3UCB):
+    """
+    C3UCB that only learns from the last few rounds. Each round adds its played contexts to V and b, and the contexts
+    of the round that falls out of the window are removed again with a negative rank k update, so V inverse is kept up
+    to date with Woodbury in both directions. Old statistics fade out gradually instead of being thrown away by a hard
+    reset when the workload shifts
+    """
+
+    def __init__(self, context_size, hyper_alpha, hyper_lambda, oracle, cluster_id=None,
+                 window_size=constants.SLIDING_WINDOW_ROUNDS):
+        super().__init__(context_size, hyper_alpha, hyper_lambda, oracle, cluster_id)
+        self.window_size = window_size
+        self.window = collections.deque()     # (context matrix, rewards) played in each round, oldest first
+        self.round_batch = None
+
+    def rank_k_update(self, context_matrix, rewards, sign=1):
+        super().rank_k_update(context_matrix, rewards, sign)
+        if sign > 0:
+            self.round_batch = (context_matrix, rewards)
+
+    def update(self, played_arms, arm_rewards, useless, mv_size_weight, index_size_weight):
+        self.round_batch = None
+        super().update(played_arms, arm_rewards, useless, mv_size_weight, index_size_weight)
+        self.slide_window()
+
+    def update_super_v3(self, played_arms, arm_rewards, useless, mv_size_weight, index_size_weight):
+        self.round_batch = None
+        super().update_super_v3(played_arms, arm_rewards, useless, mv_size_weight, index_size_weight)
+        self.slide_window()
+
+    def slide_window(self):
+        """
+        Records the contexts played in this round (empty if nothing was played) and removes the rounds that are older
+        than the window size from V and b
+        """
+        if self.round_batch is None:
+            self.round_batch = (self.get_context_matrix([]), numpy.zeros(0))
+        self.window.append(self.round_batch)
+        self.round_batch = None
+        while len(self.window) > self.window_size:
+            self.forget_oldest_round()
+
+    def forget_oldest_round(self):
+        """
+        Removes the contexts and rewards of the oldest round in the window from V and b
+        """
+        context_matrix, rewards = self.window.popleft()
+        self.rank_k_update(context_matrix, rewards, sign=-1)
+
+    def hard_reset(self):
+        super().hard_reset()
+        self.window.clear()
+
+    def workload_change_trigger(self, workload_change):
+        """
+        Instead of rescaling or resetting V, the oldest rounds of the window are forgotten in proportion to the
+        workload change
+
+        :param workload_change: Percentage of new query templates added (0-1) 0: no workload change, 1: 100% shift
+        """
+        logging.info("Workload change identified " + str(workload_change))
+        if workload_change > 0.05:
+            if workload_change > 0.1:
+                self.hyper_alpha = self.alpha_original
+            rounds_to_forget = int(numpy.ceil(len(self.window) * min(workload_change, 1)))
+            for _ in range(rounds_to_forget):
+                self.forget_oldest_round()
+            # clears the rounding error of the downdates, this only happens on a workload shift
+            self.refresh_v_inverse()
+
+    def get_state(self):
+        """
+        Adds the contexts and rewards of the rounds in the window to the bandit state, all rounds are stacked in to a
+        single matrix together with the number of rows each round has
+
+        :return: dictionary of numpy arrays
+        """
+        state = super().get_state()
+        window_contexts = [batch.toarray() if scipy.sparse.issparse(batch) else batch for batch, _ in self.window]
+        state['window_lengths'] = numpy.array([batch.shape[0] for batch in window_contexts], dtype=int)
+        state['window_contexts'] = numpy.vstack([numpy.zeros((0, self.context_size))] + window_contexts)
+        state['window_rewards'] = numpy.concatenate([numpy.zeros(0)] + [rewards for _, rewards in self.window])
+        return state
+
+    def set_state(self, state):
+        """
+        Restores the learned state and the window from a checkpoint
+
+        :param state: dictionary of numpy arrays created by get_state
+        """
+        super().set_state(state)
+        is_sparse = scipy.sparse.issparse(self.get_context_matrix([]))
+        self.window.clear()
+        start = 0
+        for length in state['window_lengths']:
+            context_matrix = numpy.array(state['window_contexts'][start:start + length], dtype=float)
+            if is_sparse:
+                context_matrix = scipy.sparse.csr_matrix(context_matrix)
+            self.window.append((context_matrix, numpy.array(state['window_rewards'][start:start + length])))
+            start += length
+
+
+class C3UCBSparseSlidingWindow(C3UCBSlidingWindow, C3UCBSparse):
+    """
+    Sliding window C3UCB for sparse contexts
+    """
+    pass
+
+
+class LinTS(C3UCB):
+    """
+    Linear Thompson sampling with the same contract as C3UCB. Instead of a confidence width per arm, a weight vector
+    is sampled from the posterior N(V^-1 b, alpha^2 V^-1) once per round and all arms are scored with a single matrix
+    vector product. A lower Cholesky factor of V is kept up to date with rank one updates, so V is never inverted
+    """
+
+    def __init__(self, context_size, hyper_alpha, hyper_lambda, oracle, cluster_id=None, seed=None):
+        super().__init__(context_size, hyper_alpha, hyper_lambda, oracle, cluster_id)
+        self.v_inverse = None
+        self.v_cholesky = numpy.sqrt(hyper_lambda) * numpy.identity(context_size)
+        self.random = numpy.random.default_rng(seed)
+
+    def get_weight_vector(self):
+        return scipy.linalg.cho_solve((self.v_cholesky, True), self.b)
+
+    def get_upper_bounds(self, context_matrix, weight_vector, creation_cost_columns):
+        """
+        Scores every arm against one weight vector sampled around the current estimate
+
+        :param context_matrix: (number of arms x context size) matrix
+        :param weight_vector: current estimate of the weight vector (column matrix)
+        :param creation_cost_columns: context positions that carry the creation cost
+        :return: numpy array of sampled rewards, one per arm
+        """
+        # V = L L^T, so L^-T z has covariance V^-1
+        noise = scipy.linalg.solve_triangular(self.v_cholesky, self.random.standard_normal(self.context_size),
+                                              lower=True, trans='T')
+        weights = weight_vector[:, 0] + self.hyper_alpha * noise
+        creation_cost = context_matrix[:, creation_cost_columns] @ weights[creation_cost_columns]
+        sampled_reward = context_matrix @ weights
+        return sampled_reward - creation_cost + creation_cost / constants.CREATION_COST_REDUCTION_FACTOR
+
+    def rank_k_update(self, context_matrix, rewards, sign=1):
+        """
+        Adds (or removes) the played contexts to V and b and applies one rank one update to the Cholesky factor per
+        context
+
+        :param context_matrix: (k x context size) matrix, one row per played context
+        :param rewards: numpy array of k rewards
+        :param sign: 1 to add the contexts, -1 to remove contexts that were added before
+        """
+        if context_matrix.shape[0] == 0:
+            return
+        if scipy.sparse.issparse(context_matrix):
+            context_matrix = context_matrix.toarray()
+        context_matrix_t = context_matrix.transpose()
+        self.v += sign * (context_matrix_t @ context_matrix)
+        self.b += sign * (context_matrix_t @ rewards).reshape(-1, 1)
+        if context_matrix.shape[0] >= self.context_size:
+            self.refresh_v_inverse()
+            return
+        for context in context_matrix:
+            if not self.cholesky_update(numpy.array(context, dtype=float), sign):
+                # a downdate lost positive definiteness to rounding, start again from V
+                self.refresh_v_inverse()
+                return
+
+    def cholesky_update(self, context, sign):
+        """
+        Rank one update of the lower Cholesky factor, L L^T + sign * x x^T, in O(d^2)
+
+        :param context: context vector x (changed in place)
+        :param sign: 1 for an update, -1 for a downdate
+        :return: False if the downdated matrix is not positive definite
+        """
+        non_zeros = numpy.flatnonzero(context)
+        if len(non_zeros) == 0:
+            return True
+        factor = self.v_cholesky
+        for k in range(non_zeros[0], self.context_size):
+            diagonal = factor[k, k] ** 2 + sign * context[k] ** 2
+            if diagonal <= 0:
+                return False
+            r = numpy.sqrt(diagonal)
+            c = r / factor[k, k]
+            s = context[k] / factor[k, k]
+            factor[k, k] = r
+            factor[k + 1:, k] = (factor[k + 1:, k] + sign * s * context[k + 1:]) / c
+            context[k + 1:] = c * context[k + 1:] - s * factor[k + 1:, k]
+        return True
+
+    def refresh_v_inverse(self):
+        """
+        LinTS keeps a Cholesky factor instead of V inverse, this recomputes the factor from V
+        """
+        self.v_cholesky = numpy.linalg.cholesky(self.v)
+
+    def hard_reset(self):
+        super().hard_reset()
+        self.v_inverse = None
+        self.refresh_v_inverse()
+
+    def get_state(self):
+        return {'v': self.v, 'v_cholesky': self.v_cholesky, 'b': self.b, 'hyper_alpha': numpy.array(self.hyper_alpha)}
+
+    def set_state(self, state):
+        self.v = numpy.array(state['v'], dtype=float)
+        self.v_cholesky = numpy.array(state['v_cholesky'], dtype=float)
+        self.b = numpy.array(state['b'], dtype=float)
+        self.hyper_alpha = float(state['hyper_alpha'])
+
+
+class LinTSSparse(LinTS, C3UCBSparse):
+    """
+    Linear Thompson sampling for sparse contexts
+    """
+    pass
+
+
+class C3UCBBank:
+    """
+    Keeps a set of C3UCB bandits (the per table bandits) in padded 3-D arrays, so scoring, updates and workload change
+    triggers of all of them are batched operations. Bandits with a smaller context use the top left block of the
+    arrays, the rest of V is lambda * I and never touched by a context, so it does not change the smaller bandit. Each
+    batched operation runs on buckets of bandits of similar size, padded only to the largest bandit of the bucket.
+    Each bandit is still reachable as a C3UCBBankMember, which behaves like a normal C3UCB on its block. Contexts are
+    dense, the bank does not support sparse contexts
+    """
+
+    def __init__(self, context_sizes, hyper_alpha, hyper_lambda, oracles, cluster_id=None):
+        bandit_count = len(context_sizes)
+        self.context_size = max(context_sizes, default=1)
+        self.alpha_original = hyper_alpha
+        self.hyper_lambda = hyper_lambda
+        self.v = hyper_lambda * numpy.tile(numpy.identity(self.context_size), (bandit_count, 1, 1))
+        self.v_inverse = (1 / hyper_lambda) * numpy.tile(numpy.identity(self.context_size), (bandit_count, 1, 1))
+        self.b = numpy.zeros((bandit_count, self.context_size, 1))
+        self.hyper_alpha = numpy.full(bandit_count, hyper_alpha, dtype=float)
+        self.members = [C3UCBBankMember(self, i, context_size, hyper_alpha, hyper_lambda, oracle, cluster_id)
+                        for i, (context_size, oracle) in enumerate(zip(context_sizes, oracles))]
+
+    def select_arms(self, context_vectors_list, current_round):
+        """
+        Scores the arms of every bandit in one batched calculation and runs the oracle of each bandit
+
+        :param context_vectors_list: context vectors of each bandit for this round (same order as members)
+        :param current_round: current round number
+        :return: list of selected arms, one entry per bandit
+        """
+        weight_vectors = self.v_inverse @ self.b
+        arm_counts = []
+        for member, context_vectors, weight_vector in zip(self.members, context_vectors_list, weight_vectors):
+            logging.info(f"================================\n{weight_vector[:member.context_size, 0].tolist()}")
+            member.context_vectors = member.get_context_matrix(context_vectors)
+            arm_counts.append(member.context_vectors.shape[0])
+
+        upper_bounds = [None] * len(self.members)
+        for bucket, context_size in self.get_buckets(arm_counts):
+            arm_count = max(arm_counts[i] for i in bucket)
+            context_matrices = numpy.zeros((len(bucket), arm_count, context_size))
+            for j, i in enumerate(bucket):
+                context_matrices[j, :arm_counts[i], :self.members[i].context_size] = self.members[i].context_vectors
+            v_inverse = self.v_inverse[bucket, :context_size, :context_size]
+            weights = weight_vectors[bucket, :context_size, 0]
+            creation_cost = context_matrices[:, :, 1] * weights[:, 1:2]
+            average_reward = numpy.einsum('nad,nd->na', context_matrices, weights) - creation_cost
+            confidence = numpy.sqrt(numpy.maximum((context_matrices @ v_inverse * context_matrices).sum(axis=2), 0))
+            bucket_upper_bounds = (average_reward + self.hyper_alpha[bucket, None] * confidence +
+                                   creation_cost / constants.CREATION_COST_REDUCTION_FACTOR)
+            for j, i in enumerate(bucket):
+                upper_bounds[i] = bucket_upper_bounds[j, :arm_counts[i]]
+
+        selected_arms = []
+        for i, member in enumerate(self.members):
+            member.upper_bounds = upper_bounds[i]
+            logging.debug(member.upper_bounds)
+            selected_arms.append(member.oracle.get_super_arm(member.upper_bounds, member.context_vectors, member.arms))
+        return selected_arms
+
+    def update(self, played_arms_list, arm_rewards, useless, mv_size_weight, index_size_weight):
+        """
+        Updates all bandits with one batched rank k update. Rewards are still converted per bandit
+
+        :param played_arms_list: list of played arms of each bandit (same order as members)
+        :param arm_rewards: tuple (gains, creation cost) reward got form playing each arm
+        """
+        batches = []
+        for member, played_arms in zip(self.members, played_arms_list):
+            if played_arms:
+                batches.append(member.get_update_batch(played_arms, arm_rewards, useless, mv_size_weight,
+                                                       index_size_weight))
+            else:
+                batches.append((numpy.zeros((0, member.context_size)), numpy.zeros(0)))
+            member.context_vectors = []
+            member.upper_bounds = []
+        self.rank_k_update(batches)
+        played = numpy.array([len(played_arms) > 0 for played_arms in played_arms_list], dtype=bool)
+        self.hyper_alpha[played] = self.hyper_alpha[played] / constants.ALPHA_REDUCTION_RATE
+
+    def get_buckets(self, counts):
+        """
+        Groups the bandits in to buckets of similar context size and count (arms or update rows), both within a factor
+        of 2, so a bucket is padded only to its own largest bandit, not to the largest table and the widest context of
+        the bank
+
+        :param counts: count of each bandit (same order as members)
+        :return: list of (bandit indexes, context size of the bucket)
+        """
+        buckets = collections.defaultdict(list)
+        for i, member in enumerate(self.members):
+            buckets[(member.context_size.bit_length(), counts[i].bit_length())].append(i)
+        return [(bucket, max(self.members[i].context_size for i in bucket)) for bucket in buckets.values()]
+
+    def rank_k_update(self, batches):
+        """
+        Batched version of the C3UCB rank k update, per bucket. Batches are padded with zero rows to the largest batch
+        of the bucket, zero rows do not change V, b or V inverse
+
+        :param batches: list of (context matrix, rewards) for each bandit
+        """
+        row_counts = [context_matrix.shape[0] for context_matrix, _ in batches]
+        for bucket, context_size in self.get_buckets(row_counts):
+            row_count = max(row_counts[i] for i in bucket)
+            if row_count == 0:
+                continue
+            context_matrices = numpy.zeros((len(bucket), row_count, context_size))
+            rewards = numpy.zeros((len(bucket), row_count, 1))
+            for j, i in enumerate(bucket):
+                context_matrix, batch_rewards = batches[i]
+                context_matrices[j, :row_counts[i], :context_matrix.shape[1]] = context_matrix
+                rewards[j, :row_counts[i], 0] = batch_rewards
+            context_matrices_t = context_matrices.transpose(0, 2, 1)
+            v = self.v[bucket, :context_size, :context_size] + context_matrices_t @ context_matrices
+            self.v[bucket, :context_size, :context_size] = v
+            self.b[bucket, :context_size] += context_matrices_t @ rewards
+            if row_count >= context_size:
+                self.v_inverse[bucket, :context_size, :context_size] = numpy.linalg.inv(v)
+            else:
+                v_inverse = self.v_inverse[bucket, :context_size, :context_size]
+                v_inverse_xt = v_inverse @ context_matrices_t
+                capacitance = numpy.identity(row_count) + context_matrices @ v_inverse_xt
+                self.v_inverse[bucket, :context_size, :context_size] = v_inverse - v_inverse_xt @ numpy.linalg.solve(
+                    capacitance, v_inverse_xt.transpose(0, 2, 1))
+
+    def workload_change_trigger(self, workload_change):
+        """
+        Batched version of C3UCB workload_change_trigger, applied to all bandits
+
+        :param workload_change: Percentage of new query templates added (0-1) 0: no workload change, 1: 100% shift
+        """
+        logging.info("Workload change identified " + str(workload_change))
+        if workload_change > 0.5:
+            self.hard_reset()
+        elif workload_change > 0.05:
+            forget_factor = 1 - workload_change * 2
+            if workload_change > 0.1:
+                self.hyper_alpha[:] = self.alpha_original
+            for bucket, context_size in self.get_buckets([1] * len(self.members)):
+                v = (self.hyper_lambda * numpy.identity(context_size) +
+                     forget_factor * self.v[bucket, :context_size, :context_size])
+                self.v[bucket, :context_size, :context_size] = v
+                self.v_inverse[bucket, :context_size, :context_size] = numpy.linalg.inv(v)
+            self.b = forget_factor * self.b
+
+    def hard_reset(self):
+        """
+        Resets all bandits
+        """
+        self.hyper_alpha[:] = self.alpha_original
+        self.v[:] = self.hyper_lambda * numpy.identity(self.context_size)
+        self.v_inverse[:] = (1 / self.hyper_lambda) * numpy.identity(self.context_size)
+        self.b[:] = 0
+
+
+class C3UCBBankMember(C3UCB):
+    """
+    A single bandit of a C3UCBBank. V, V inverse, b and alpha are views on the bank arrays, so the usual C3UCB
+    methods (and checkpoints) work on the bandit alone
+    """
+
+    def __init__(self, bank, bank_index, context_size, hyper_alpha, hyper_lambda, oracle, cluster_id=None):
+        self.bank = bank
+        self.bank_index = bank_index
+        self.context_size = context_size
+        super().__init__(context_size, hyper_alpha, hyper_lambda, oracle, cluster_id)
+
+    @property
+    def v(self):
+        return self.bank.v[self.bank_index, :self.context_size, :self.context_size]
+
+    @v.setter
+    def v(self, value):
+        self.bank.v[self.bank_index, :self.context_size, :self.context_size] = value
+
+    @property
+    def v_inverse(self):
+        return self.bank.v_inverse[self.bank_index, :self.context_size, :self.context_size]
+
+    @v_inverse.setter
+    def v_inverse(self, value):
+        self.bank.v_inverse[self.bank_index, :self.context_size, :self.context_size] = value
+
+    @property
+    def b(self):
+        return self.bank.b[self.bank_index, :self.context_size]
+
+    @b.setter
+    def b(self, value):
+        self.bank.b[self.bank_index, :self.context_size] = value
+
+    @property
+    def hyper_alpha(self):
+        return self.bank.hyper_alpha[self.bank_index]
+
+    @hyper_alpha.setter
+    def hyper_alpha(self, value):
+        self.bank.hyper_alpha[self.bank_index] = value
+
+
+def get_bandit_class(algorithm, sparse_context=False):
+    """
+    Returns the bandit class to use for the given algorithm
+
+    :param algorithm: one of the bandit algorithm names in constants
+    :param sparse_context: if the contexts are given as sparse rows
+    :return: bandit class
+    """
+    if algorithm == constants.BANDIT_C3UCB:
+        return C3UCBSparse if sparse_context else C3UCB
+    elif algorithm == constants.BANDIT_C3UCB_SLIDING_WINDOW:
+        return C3UCBSparseSlidingWindow if sparse_context else C3UCBSlidingWindow
+    elif algorithm == constants.BANDIT_LIN_TS:
+        return LinTSSparse if sparse_context else LinTS
+    raise Exception(f'Unknown bandit algorithm {algorithm}')
@@ -1,26 +1,33 @@
-import itertools
+import heapq
+import logging
+import zlib
+
 import numpy
+import scipy.sparse
 
 import constants as constants
-from bandits.bandit_arm_v1 import BanditArm
+from bandits.bandit_arm_v1 import BanditArm, arm_indexes
 from database.qplan.write import WriteQueryPlan, InsertQueryPlan, DeleteQueryPlan, UpdateQueryPlan
 from bandits.bandit_arm_MV_v1 import BanditArmMV
+from bandits.bandit_arm_store_v1 import BanditArmStore
 import database.sql_helper_v3 as sql_helper
 
-bandit_arm_store = {}
+bandit_arm_store = BanditArmStore()
+column_position_maps = {}   # table names -> column position map of the name encode
 table_scan_times = sql_helper.get_table_scan_times_structure()
 table_scan_times_hyp = sql_helper.get_table_scan_times_structure()
 
 # ========================== Arm Generation ==========================
 
 
-def gen_arms_from_predicates_v2(connection, query_obj):
+def gen_arms_from_predicates_v2(connection, query_obj, query_properties=None):
     """
-    This method take predicates (a dictionary of lists) as input and creates the generate arms for all possible
-    column combinations
+    This method take predicates (a dictionary of lists) as input and creates the generate arms for the best
+    column permutations (at most INDEX_ARM_BUDGET per table, all of them if the budget is 0)
 
     :param connection: SQL connection
     :param query_obj: Query object
+    :param query_properties: parsed query properties, used for the predicate types
     :return: list of bandit arms
     """
     bandit_arms = {}
@@ -28,6 +35,8 @@ def gen_arms_from_predicates_v2(connection, query_obj):
     payloads = query_obj.payload
     query_id = query_obj.id
     tables = sql_helper.get_tables(connection)
+    key_column_orders = {}
+    unsized_arms = []   # new arms and their columns, sized together at the end
     for table_name, table_predicates in predicates.items():
         table = tables[table_name]
         includes = []
@@ -35,11 +44,10 @@ def gen_arms_from_predicates_v2(connection, query_obj):
             includes = list(set(payloads[table_name]) - set(table_predicates))
         if table.table_row_count < constants.SMALL_TABLE_IGNORE:
             continue
-        col_permutations = []
-        if len(table_predicates) > 6:
-            table_predicates = table_predicates[0:6]
-        for j in range(1, (len(table_predicates) + 1)):
-            col_permutations = col_permutations + list(itertools.permutations(table_predicates, j))
+        key_column_orders[table_name] = get_key_column_order(connection, query_id, table_name, table_predicates,
+                                                             query_properties)
+        table_predicates = key_column_orders[table_name][0:6]
+        col_permutations = gen_key_column_permutations(table_predicates, constants.INDEX_ARM_BUDGET)
         for col_permutation in col_permutations:
             arm_id = BanditArm.get_arm_id(col_permutation, table_name)
             table_row_count = table.table_row_count
@@ -54,9 +62,8 @@ def gen_arms_from_predicates_v2(connection, query_obj):
                 # else:
                 #     bandit_arm.arm_value[query_id] = arm_value
             else:
-                size = sql_helper.get_estimated_size_of_index_v1(connection, constants.SCHEMA_NAME,
-                                                                 table_name, col_permutation)
-                bandit_arm = BanditArm(col_permutation, table_name, size, table_row_count)
+                bandit_arm = BanditArm(col_permutation, table_name, None, table_row_count)
+                unsized_arms.append((bandit_arm, col_permutation))
                 bandit_arm.query_id = query_id
                 if len(col_permutation) == len(table_predicates):
                     bandit_arm.cluster = table_name + '_' + str(query_id) + '_all'
@@ -85,9 +92,8 @@ def gen_arms_from_predicates_v2(connection, query_obj):
                 # else:
                 #     bandit_arm.arm_value[query_id] = arm_value
             else:
-                size = sql_helper.get_estimated_size_of_index_v1(connection, constants.SCHEMA_NAME,
-                                                                 table_name, col_permutation)
-                bandit_arm = BanditArm(col_permutation, table_name, size, table_row_count)
+                bandit_arm = BanditArm(col_permutation, table_name, None, table_row_count)
+                unsized_arms.append((bandit_arm, col_permutation))
                 bandit_arm.query_id = query_id
                 bandit_arm.cluster = table_name + '_' + str(query_id) + '_all'
                 bandit_arm.is_include = 1
@@ -105,19 +111,16 @@ def gen_arms_from_predicates_v2(connection, query_obj):
             if table_name in payloads:
                 includes = sorted(list(set(payloads[table_name]) - set(table_predicates)))
             if includes:
-                col_permutations = list(itertools.permutations(table_predicates, len(table_predicates)))
+                col_permutations = gen_key_column_permutations(key_column_orders[table_name],
+                                                               constants.INDEX_ARM_BUDGET, len(table_predicates),
+                                                               full_length_only=True)
                 for col_permutation in col_permutations:
                     arm_id_with_include = BanditArm.get_arm_id(col_permutation, table_name, includes)
                     table_row_count = table.table_row_count
                     # arm_value = (1 - query_obj.selectivity[table_name]) * table_row_count
                     if arm_id_with_include not in bandit_arm_store:
-                        size_with_includes = sql_helper.get_estimated_size_of_index_v1(connection,
-                                                                                       constants.SCHEMA_NAME,
-                                                                                       table_name,
-                                                                                       col_permutation + tuple(
-                                                                                           includes))
-                        bandit_arm = BanditArm(col_permutation, table_name, size_with_includes, table_row_count,
-                                               includes)
+                        bandit_arm = BanditArm(col_permutation, table_name, None, table_row_count, includes)
+                        unsized_arms.append((bandit_arm, col_permutation + tuple(includes)))
                         bandit_arm.is_include = 1
                         bandit_arm.query_id = query_id
                         bandit_arm.cluster = table_name + '_' + str(query_id) + '_all'
@@ -131,35 +134,174 @@ def gen_arms_from_predicates_v2(connection, query_obj):
                         # else:
                         #     bandit_arm_store[arm_id_with_include].arm_value[query_id] = arm_value
                     bandit_arms[arm_id_with_include] = bandit_arm_store[arm_id_with_include]
+
+    set_estimated_index_sizes(connection, unsized_arms)
     return bandit_arms
 
 
-def gen_frq_table_subsets(connection, query_objs, all_tables, query_properties):
-    frq_table_subsets = {}
-    total_workload_time = 0
+def set_estimated_index_sizes(connection, unsized_arms):
+    """
+    Sets the estimated size of new index arms, all arms of a table are estimated in one batch
+
+    :param connection: SQL connection
+    :param unsized_arms: list of (bandit arm, index columns including the includes)
+    """
+    table_arms = {}
+    for bandit_arm, col_names in unsized_arms:
+        table_arms.setdefault(bandit_arm.table_name, []).append((bandit_arm, col_names))
+    for table_name, arms in table_arms.items():
+        sizes = sql_helper.get_estimated_sizes_of_indexes(connection, constants.SCHEMA_NAME, table_name,
+                                                          [col_names for _, col_names in arms])
+        for (bandit_arm, _), size in zip(arms, sizes):
+            bandit_arm.memory = float(size)
+
+
+def get_key_column_order(connection, query_id, table_name, table_predicates, query_properties=None):
+    """
+    Orders the predicate columns of a table by how useful they are as leading index keys. Equality predicates come
+    before range predicates, then more selective columns first
+
+    :param connection: SQL connection
+    :param query_id: query id
+    :param table_name: table name
+    :param table_predicates: predicate columns of the table
+    :param query_properties: parsed query properties, used for the predicate types
+    :return: list of columns, best first
+    """
+    predicate_types = {}
+    if query_properties and query_id in query_properties['payload']:
+        predicate_types = query_properties['payload'][query_id].get(table_name, {})
+
+    def get_order_key(position_and_column):
+        position, column = position_and_column
+        predicate_type = predicate_types.get(column)
+        if predicate_type in {'EQ', 'IS'}:
+            type_rank = 0
+        elif predicate_type in {'GT', 'LT', 'GE', 'LE', 'like'}:
+            type_rank = 1
+        else:
+            type_rank = 2
+        selectivity = sql_helper.get_column_selectivity(connection, constants.SCHEMA_NAME, table_name, column)
+        return type_rank, selectivity, position
+
+    return [column for _, column in sorted(enumerate(table_predicates), key=get_order_key)]
+
+
+def gen_key_column_permutations(ordered_columns, budget, max_length=6, full_length_only=False):
+    """
+    Best first search over the prefix tree of key column permutations. The cost of a permutation is how far each
+    column is from its place in ordered_columns, so [c0], [c0, c1], ... come first. The cost of a node is never less
+    than the cost of its prefix, so every prefix of an emitted permutation is emitted before it and each prefix is
+    visited once
+
+    :param ordered_columns: key columns, best first
+    :param budget: maximum number of permutations, 0 for all of them
+    :param max_length: maximum number of key columns in a permutation
+    :param full_length_only: only emit permutations of max_length columns (prefixes are still searched)
+    :return: list of column tuples, best first
+    """
+    max_length = min(max_length, len(ordered_columns))
+    permutations = []
+    heap = [(0, 0, ())]
+    while heap and (budget <= 0 or len(permutations) < budget):
+        cost, length, prefix = heapq.heappop(heap)
+        if length > 0 and (not full_length_only or length == max_length):
+            permutations.append(tuple(ordered_columns[i] for i in prefix))
+        if length < max_length:
+            for i in range(len(ordered_columns)):
+                if i not in prefix:
+                    heapq.heappush(heap, (cost + abs(i - length), length + 1, prefix + (i,)))
+    return permutations
+
+
+def gen_frq_table_subsets(connection, query_objs, all_tables, query_properties, subset_index):
+    """
+    Finds the table subsets (2 or more tables) that can be joined in the queries of the window and take at least 5% of
+    the workload time. Subsets are the connected subgraphs of the join graph of each query, taken from the table
+    subset index, which enumerates them once per query template and prunes them by support when they are counted.
+    Subsets with the same tables in different queries are counted together, in the table order of the first query.
+
+    :param connection: SQL connection
+    :param query_objs: queries in the current window
+    :param all_tables: tables in the database
+    :param query_properties: parsed query properties (tables and joins of each query)
+    :param subset_index: TableSubsetIndex kept across rounds, its frequent subsets are updated for this round
+    :return: dict of table subsets (tuples) to workload time, most frequent first
+    """
+    total_workload_time = sum(query_obj.original_running_time for query_obj in query_objs)
+    min_support = total_workload_time * 0.05
     min_rows = sum([x.table_row_count for x in all_tables.values()]) * 0.1
-    for query_obj in query_objs:
-        total_workload_time += query_obj.original_running_time
-        table_set = query_properties['tables'][query_obj.id]
-        for i in range(2, len(table_set)+1):
-            table_subsets = list(itertools.combinations(table_set, i))
-            for table_subset in table_subsets:
-                if can_be_joined(table_subset, query_properties['joins'][query_obj.id]):
-                    if table_subset in frq_table_subsets:
-                        frq_table_subsets[table_subset] += query_obj.original_running_time
-                    else:
-                        frq_table_subsets[table_subset] = query_obj.original_running_time
+    subset_index.update_window(query_objs)
+    frq_table_subsets = subset_index.count_table_subsets(query_objs, min_support)
+
     subset_list = list(frq_table_subsets.keys())
     for table_subset in subset_list:
-        if frq_table_subsets[table_subset] < total_workload_time * 0.05:
-            del frq_table_subsets[table_subset]
-        elif sum(map(lambda x: all_tables[x].table_row_count, table_subset)) < min_rows:
+        if sum(map(lambda x: all_tables[x].table_row_count, table_subset)) < min_rows:
             del frq_table_subsets[table_subset]
 
     frq_table_subsets = dict(sorted(frq_table_subsets.items(), key=lambda item: item[1], reverse=True))
+    subset_index.set_frequent_subsets(frq_table_subsets)
     return frq_table_subsets
 
 
+def get_join_adjacency(table_set, query_joins):
+    """
+    Join graph of a query as a list of neighbour bitmasks, one per table (bit i is table_set[i])
+
+    :param table_set: tables of the query
+    :param query_joins: joins of the query, (table1, table2) -> join columns
+    :return: list of bitmasks
+    """
+    positions = {table_name: i for i, table_name in enumerate(table_set)}
+    adjacency = [0] * len(table_set)
+    for table1, table2 in query_joins:
+        if table1 in positions and table2 in positions and table1 != table2:
+            adjacency[positions[table1]] |= 1 << positions[table2]
+            adjacency[positions[table2]] |= 1 << positions[table1]
+    return adjacency
+
+
+def get_mask_positions(mask):
+    """
+    Positions of the set bits of a bitmask, lowest first
+
+    :param mask: bitmask
+    :return: list of positions
+    """
+    positions = []
+    while mask:
+        lowest_bit = mask & -mask
+        positions.append(lowest_bit.bit_length() - 1)
+        mask ^= lowest_bit
+    return positions
+
+
+def gen_connected_subgraphs(adjacency):
+    """
+    Enumerates every connected subgraph with 2 or more nodes exactly once (EnumerateCsg of DPccp). Starting from each
+    node, a subgraph only grows in to neighbours that are not excluded, the excluded set holds the lower numbered start
+    nodes and the neighbours already tried, so the same subgraph is never built twice.
+
+    :param adjacency: list of neighbour bitmasks
+    :return: generator of bitmasks
+    """
+    for i in range(len(adjacency) - 1, -1, -1):
+        start = 1 << i
+        stack = [(start, (start << 1) - 1)]
+        while stack:
+            subgraph, excluded = stack.pop()
+            neighbours = 0
+            for position in get_mask_positions(subgraph):
+                neighbours |= adjacency[position]
+            neighbours &= ~excluded
+            extension = neighbours
+            while extension:
+                new_subgraph = subgraph | extension
+                yield new_subgraph
+                stack.append((new_subgraph, excluded | neighbours))
+                extension = (extension - 1) & neighbours
+
+
 def can_be_joined(table_subset, query_joins):
     tables_can_be_joined = set()
     join_count = 0
@@ -266,28 +408,106 @@ def gen_mv_arms_from_predicates_v3(connection, query_obj, tables, frequent_table
     return bandit_arms
 
 
-def finalizing_mv_arms(connection, bandit_arms_mv, query_properties, max_memory):
+def finalizing_mv_arms(connection, bandit_arms_mv, query_properties, max_memory, connection_pool=None):
+    """
+    Builds the view and index queries of new MV arms and estimates their size. Arms that could not be estimated or are
+    too large are removed. Row counts come from the persistent count cache when possible, the rest are run on the
+    connection pool concurrently (or serially on the connection) and saved to the cache.
+
+    :param connection: SQL connection
+    :param bandit_arms_mv: MV arms of the round
+    :param query_properties: parsed query properties (dimension tables)
+    :param max_memory: memory budget
+    :param connection_pool: SQLConnectionPool for the row counts, counted serially on the connection if None
+    """
     ids_to_delete = []
-    connection.timeout = 60
+    new_arms = []
+    count_queries = {}
     for arm_id, arm in bandit_arms_mv.items():
         if arm.memory == -1:
             ids_to_delete.append(arm_id)
-        elif arm.memory is None:
+        elif arm.view_query is None:
             view_query, count_query = get_mv_arm_view_query(arm.index_name, arm.view_query_comps)
-            index_query = get_mv_arm_index_query(arm.index_name, arm.index_query_comps)
+            arm.view_query = view_query
+            arm.index_query = get_mv_arm_index_query(arm.index_name, arm.index_query_comps)
             dim_tables = query_properties['dim_tables']
             count_query_id = tuple(sorted(set(arm.table_names).difference(dim_tables)))
-            size = sql_helper.get_estimated_size_of_mv_v2(connection, arm.payload,
-                                                          view_query[view_query.lower().index("select"):],
-                                                          count_query, count_query_id, arm.group_by)
-            arm.view_query = view_query
-            arm.index_query = index_query
-            arm.memory = size
-            if size <= 0 or size > 5000:
-                ids_to_delete.append(arm_id)
+            key, count_query_job = sql_helper.get_mv_count_query(view_query[view_query.lower().index("select"):],
+                                                                 count_query, count_query_id, arm.group_by)
+            count_queries[key] = count_query_job
+            new_arms.append((arm_id, arm, key))
+
+    row_counts = sql_helper.get_mv_row_counts(connection, count_queries, constants.MV_ESTIMATION_TIMEOUT,
+                                              connection_pool)
+    for arm_id, arm, key in new_arms:
+        size = sql_helper.get_estimated_size_of_mv_rows(connection, arm.payload, row_counts[key])
+        arm.memory = size
+        if size <= 0 or size > 5000:
+            ids_to_delete.append(arm_id)
     for arm_id in ids_to_delete:
         del bandit_arms_mv[arm_id]
-    connection.timeout = 0
+    sql_helper.save_count_cache()
+
+
+def finalizing_mv_arms_lazy(connection, bandit, bandit_arms_mv, all_columns, number_of_columns,
+                            chosen_arms_last_round, database_size, query_properties, max_memory, connection_pool=None):
+    """
+    Deferred version of finalizing_mv_arms. Pending arms (size not estimated yet) get a provisional size and are scored
+    by the MV bandit together with the finalized arms. Only the pending arms among the MV_FINALIZATION_CANDIDATES arms
+    with the highest upper bound are finalized, the rest stay pending and are left out of this round.
+
+    :param connection: SQL connection
+    :param bandit: MV bandit
+    :param bandit_arms_mv: MV arms of the round
+    :param all_columns: all columns in the database
+    :param number_of_columns: number of columns in the database
+    :param chosen_arms_last_round: Already created arms
+    :param database_size: size of the database in MB
+    :param query_properties: parsed query properties (dimension tables)
+    :param max_memory: memory budget
+    :param connection_pool: SQLConnectionPool for the row counts, counted serially on the connection if None
+    """
+    pending_arms = {arm_id: arm for arm_id, arm in bandit_arms_mv.items() if arm.view_query is None}
+    if not pending_arms:
+        return
+    for arm in pending_arms.values():
+        if arm.memory is None:
+            arm.memory = get_provisional_mv_size(connection, arm)
+
+    arm_ids = list(bandit_arms_mv.keys())
+    if constants.SPARSE_CONTEXT:
+        context_vectors = get_view_encode_cv_sparse_v1(connection, bandit_arms_mv, all_columns, number_of_columns,
+                                                       chosen_arms_last_round, database_size)
+    else:
+        context_vectors = get_view_encode_cv_v1(connection, bandit_arms_mv, all_columns, number_of_columns,
+                                                chosen_arms_last_round, database_size)
+    upper_bounds = bandit.get_arm_upper_bounds(context_vectors)
+    candidate_arms = {}
+    for i in numpy.argsort(-upper_bounds, kind='stable')[:constants.MV_FINALIZATION_CANDIDATES]:
+        arm = bandit_arms_mv[arm_ids[i]]
+        if arm.view_query is None:
+            # the cached context has the provisional size
+            arm.name_encoded_context = []
+            candidate_arms[arm_ids[i]] = arm
+    logging.info(f"Finalizing {len(candidate_arms)} of {len(pending_arms)} pending MV arms")
+    finalizing_mv_arms(connection, candidate_arms, query_properties, max_memory, connection_pool)
+    for arm_id in pending_arms:
+        if arm_id not in candidate_arms:
+            del bandit_arms_mv[arm_id]
+
+
+def get_provisional_mv_size(connection, arm):
+    """
+    Size of a MV before its rows are counted, the payload row length over the rows of the largest table. Exact for
+    views joining facts to dimensions on their keys, an upper bound for group by views.
+
+    :param connection: SQL connection
+    :param arm: MV arm
+    :return: provisional size in MB
+    """
+    tables = sql_helper.get_tables(connection)
+    estimated_rows = max(tables[table_name].table_row_count for table_name in arm.table_names)
+    return sql_helper.get_estimated_size_of_mv_rows(connection, arm.payload, estimated_rows)
 
 
 def get_mv_arm_view_query(arm_id, view_comps):
@@ -348,10 +568,65 @@ def get_predicate_position(arm, predicate, table_name):
     return -1
 
 
+def get_column_position_map(all_columns):
+    """
+    Positions of the columns in the name encode blocks, built once for a set of tables. A column name maps to all its
+    (table name, position) pairs, as includes are matched on the column name only
+
+    :param all_columns: predicate dict(list)
+    :return: dict of column name -> list of (table name, position)
+    """
+    key = tuple(all_columns)
+    if key not in column_position_maps:
+        position_map = {}
+        i = 0
+        for table_name in all_columns:
+            for column_name in all_columns[table_name]:
+                position_map.setdefault(column_name, []).append((table_name, i))
+                i += 1
+        column_position_maps[key] = position_map
+    return column_position_maps[key]
+
+
+def get_context_entries_v2(bandit_arm, all_columns, context_size, uniqueness=0, includes=False):
+    """
+    Return the non zero positions and values of the name encoded context of a given arm. The encode has a block per
+    unique column position, one block for the rest of the key columns and (optionally) one block for the includes.
+    Only the key and include columns of the arm are looked up in the column position map.
+
+    :param bandit_arm: bandit arm
+    :param all_columns: predicate dict(list)
+    :param context_size: number of columns, size of one encode block
+    :param uniqueness: how many columns in the index to consider when considering the context
+    :param includes: add includes to the arm encode
+    :return: list of positions, list of values
+    """
+    position_map = get_column_position_map(all_columns)
+    positions = []
+    values = []
+    for column_position_in_arm, column_name in enumerate(bandit_arm.index_cols):
+        for table_name, i in position_map.get(column_name, ()):
+            if table_name != bandit_arm.table_name:
+                continue
+            if column_position_in_arm < uniqueness:
+                positions.append(column_position_in_arm * context_size + i)
+                values.append(1)
+            else:
+                positions.append(uniqueness * context_size + i)
+                values.append(1 / (10 ** column_position_in_arm))
+    if includes:
+        for column_name in bandit_arm.include_cols:
+            for table_name, i in position_map.get(column_name, ()):
+                if table_name != bandit_arm.table_name or column_name not in bandit_arm.index_cols:
+                    positions.append((uniqueness + 1) * context_size + i)
+                    values.append(1)
+    return positions, values
+
+
 def get_context_vector_v2(bandit_arm, all_columns, context_size, uniqueness=0, includes=False):
     """
     Return the context vector for a given arm, and set of predicates. Size of the context vector will depend on
-    the arm and the set of predicates (for now on predicates)
+    the arm and the set of predicates (for now on predicates). The encode is cached on the arm as a sparse row
 
     :param bandit_arm: bandit arm
     :param all_columns: predicate dict(list)
@@ -360,86 +635,175 @@ def get_context_vector_v2(bandit_arm, all_columns, context_size, uniqueness=0, i
     :param includes: add includes to the arm encode
     :return: a context vector
     """
-    context_vectors = {}
-    for j in range(uniqueness):
-        context_vectors[j] = numpy.zeros((context_size, 1), dtype=float)
-    left_over_context = numpy.zeros((context_size, 1), dtype=float)
-    include_context = numpy.zeros((context_size, 1), dtype=float)
+    return get_context_vector_sparse_v1(bandit_arm, all_columns, context_size, uniqueness, includes).toarray().T
+
+
+def get_context_vector_sparse_v1(bandit_arm, all_columns, context_size, uniqueness=0, includes=False):
+    """
+    Sparse version of get_context_vector_v2, returns the name encode as a single CSR row
 
-    if len(bandit_arm.name_encoded_context) > 0:
+    :param bandit_arm: bandit arm
+    :param all_columns: predicate dict(list)
+    :param context_size: size of the context vector
+    :param uniqueness: how many columns in the index to consider when considering the context
+    :param includes: add includes to the arm encode
+    :return: a (1 x encode size) CSR matrix
+    """
+    if scipy.sparse.issparse(bandit_arm.name_encoded_context):
         context_vector = bandit_arm.name_encoded_context
     else:
-        i = 0
-        for table_name in all_columns:
-            for k in range(len(all_columns[table_name])):
-                column_position_in_arm = get_predicate_position(bandit_arm, all_columns[table_name][k], table_name)
-                if column_position_in_arm >= 0:
-                    if column_position_in_arm < uniqueness:
-                        context_vectors[column_position_in_arm][i] = 1
-                    else:
-                        left_over_context[i] = 1 / (10 ** column_position_in_arm)
-                elif all_columns[table_name][k] in bandit_arm.include_cols:
-                    include_context[i] = 1
-                i += 1
-
-        full_list = []
-        for j in range(uniqueness):
-            full_list = full_list + list(context_vectors[j])
-        full_list = full_list + list(left_over_context)
-        if includes:
-            full_list = full_list + list(include_context)
-        context_vector = numpy.array(full_list, ndmin=2, dtype=float)
+        positions, values = get_context_entries_v2(bandit_arm, all_columns, context_size, uniqueness, includes)
+        context_vector = scipy.sparse.csr_matrix((values, ([0] * len(positions), positions)),
+                                                 shape=(1, (uniqueness + 1 + int(includes)) * context_size))
         bandit_arm.name_encoded_context = context_vector
     return context_vector
 
 
-def get_context_vector_mv_v1(connection, bandit_arm, all_columns, number_of_columns, chosen_arms_last_round):
+def get_context_entries_mv_v1(connection, bandit_arm, all_columns, number_of_columns, chosen_arms_last_round,
+                              database_size=None):
     """
-    Return the context vector for a given arm, and set of predicates. Size of the context vector will depend on
-    the arm and the set of predicates (for now on predicates)
+    Return the non zero positions and values of the MV context of a given arm. Context has 4 additional values,
+    followed by a table encode and a column encode
 
     :param connection: SQL connection
     :param bandit_arm: bandit arm
     :param all_columns: predicate dict(list)
     :param number_of_columns: number of columns in the database
     :param chosen_arms_last_round: Already created arms
-    :return: a context vector
+    :param database_size: size of the database in MB, queried when not given
+    :return: list of positions, list of values, context size
     """
-
-    if len(bandit_arm.name_encoded_context) > 0:
-        context_vector = bandit_arm.name_encoded_context
+    positions = []
+    values = []
+    table_names = list(all_columns.keys())
+    table_names.sort()
+    if constants.MV_CONTEXT_DIMENSION > 0:
+        positions, values = get_hashed_encode_entries_mv(bandit_arm, all_columns)
     else:
-        table_names = list(all_columns.keys())
-        table_names.sort()
-        table_context = numpy.zeros((len(table_names), 1), dtype=float)
         for i, table_name in enumerate(table_names):
             if table_name in bandit_arm.table_names:
-                table_context[i] = 1
+                positions.append(4 + i)
+                values.append(1)
 
         i = 0
-        column_context = numpy.zeros((number_of_columns, 1), dtype=float)
         for table_name in all_columns:
             for k in range(len(all_columns[table_name])):
                 if table_name in bandit_arm.payload and all_columns[table_name][k] in bandit_arm.payload[table_name]:
-                    column_context[i] = 1
+                    positions.append(4 + len(table_names) + i)
+                    values.append(1)
                 i += 1
 
+    if database_size is None:
         database_size = sql_helper.get_database_size(connection)
-        keys_last_round = set(chosen_arms_last_round.keys())
-        if bandit_arm.index_name not in keys_last_round:
-            index_size = bandit_arm.memory
-        else:
-            index_size = 0
+    keys_last_round = set(chosen_arms_last_round.keys())
+    if bandit_arm.arm_index not in keys_last_round:
+        index_size = bandit_arm.memory
+    else:
+        index_size = 0
+
+    positions.append(1)
+    values.append(index_size / database_size)
+    if bandit_arm.group_by:
+        positions.append(2)
+        values.append(1)
+    if bandit_arm.filter_by:
+        positions.append(3)
+        values.append(1)
+    return positions, values, get_mv_context_size(len(table_names), number_of_columns)
+
+
+def get_mv_context_size(number_of_tables, number_of_columns):
+    """
+    Size of the MV context, 4 additional values followed by the table and column encode. When MV_CONTEXT_DIMENSION is
+    set the encode is hashed in to that many positions, so the size does not depend on the schema width
+
+    :param number_of_tables: number of tables in the database
+    :param number_of_columns: number of columns in the database
+    :return: context size
+    """
+    if constants.MV_CONTEXT_DIMENSION > 0:
+        return 4 + constants.MV_CONTEXT_DIMENSION
+    return 4 + number_of_tables + number_of_columns
+
+
+def get_hashed_feature(feature):
+    """
+    Position (within the hashed encode) and sign of a table or column feature. crc32 is used as it is stable between
+    runs, unlike the built-in hash of strings
+
+    :param feature: feature name, table name or table.column
+    :return: position, sign
+    """
+    feature_hash = zlib.crc32(feature.encode())
+    position = feature_hash % constants.MV_CONTEXT_DIMENSION
+    sign = 1 if (feature_hash // constants.MV_CONTEXT_DIMENSION) % 2 == 0 else -1
+    return position, sign
+
 
-        additional_context = numpy.zeros((4, 1), dtype=float)
-        additional_context[1] = index_size / database_size
-        if bandit_arm.group_by:
-            additional_context[2] = 1
-        if bandit_arm.filter_by:
-            additional_context[3] = 1
-        full_list = list(additional_context) + list(table_context) + list(column_context)
+def get_hashed_encode_entries_mv(bandit_arm, all_columns):
+    """
+    Feature hashed version of the MV table and column encode. Each table and column used by the view adds +/-1 to its
+    hashed position, features that land in the same position are added together
+
+    :param bandit_arm: bandit arm
+    :param all_columns: predicate dict(list)
+    :return: list of positions, list of values
+    """
+    encode = {}
+    for table_name in bandit_arm.table_names:
+        if table_name in all_columns:
+            position, sign = get_hashed_feature(table_name)
+            encode[position] = encode.get(position, 0) + sign
+    for table_name, columns in bandit_arm.payload.items():
+        if table_name in all_columns:
+            table_columns = set(all_columns[table_name])
+            for column in columns:
+                if column in table_columns:
+                    position, sign = get_hashed_feature(f'{table_name}.{column}')
+                    encode[position] = encode.get(position, 0) + sign
+    positions = [4 + position for position, value in encode.items() if value != 0]
+    values = [value for value in encode.values() if value != 0]
+    return positions, values
+
+
+def get_context_vector_mv_v1(connection, bandit_arm, all_columns, number_of_columns, chosen_arms_last_round,
+                             database_size=None):
+    """
+    Return the context vector for a given arm, and set of predicates. Size of the context vector will depend on
+    the arm and the set of predicates (for now on predicates)
 
-        context_vector = numpy.array(full_list, ndmin=2, dtype=float)
+    :param connection: SQL connection
+    :param bandit_arm: bandit arm
+    :param all_columns: predicate dict(list)
+    :param number_of_columns: number of columns in the database
+    :param chosen_arms_last_round: Already created arms
+    :param database_size: size of the database in MB, queried when not given
+    :return: a context vector
+    """
+    return get_context_vector_mv_sparse_v1(connection, bandit_arm, all_columns, number_of_columns,
+                                           chosen_arms_last_round, database_size).toarray().T
+
+
+def get_context_vector_mv_sparse_v1(connection, bandit_arm, all_columns, number_of_columns, chosen_arms_last_round,
+                                    database_size=None):
+    """
+    Sparse version of get_context_vector_mv_v1, returns the MV context as a single CSR row
+
+    :param connection: SQL connection
+    :param bandit_arm: bandit arm
+    :param all_columns: predicate dict(list)
+    :param number_of_columns: number of columns in the database
+    :param chosen_arms_last_round: Already created arms
+    :param database_size: size of the database in MB, queried when not given
+    :return: a (1 x context size) CSR matrix
+    """
+    if scipy.sparse.issparse(bandit_arm.name_encoded_context):
+        context_vector = bandit_arm.name_encoded_context
+    else:
+        positions, values, context_size = get_context_entries_mv_v1(connection, bandit_arm, all_columns,
+                                                                    number_of_columns, chosen_arms_last_round,
+                                                                    database_size)
+        context_vector = scipy.sparse.csr_matrix((values, ([0] * len(positions), positions)), shape=(1, context_size))
         bandit_arm.name_encoded_context = context_vector
     return context_vector
 
@@ -448,7 +812,7 @@ def get_super_arm_context_v1(connection, arm, ucb, chosen_arms_last_round, stati
     database_size = sql_helper.get_database_size(connection)
     context = numpy.zeros((static_context_size + number_of_clusters, 1), dtype=float)
     keys_last_round = set(chosen_arms_last_round.keys())
-    if arm.index_name not in keys_last_round:
+    if arm.arm_index not in keys_last_round:
         index_size = arm.memory
     else:
         index_size = 0
@@ -472,16 +836,13 @@ def get_name_encode_cv_v2(bandit_arm_dict, all_columns, context_size, uniqueness
     :param includes: add includes to the arm encode
     :return: list of context vectors
     """
-    context_vectors = []
-    for key, bandit_arm in bandit_arm_dict.items():
-        context_vector = get_context_vector_v2(bandit_arm, all_columns, context_size, uniqueness, includes)
-        context_vectors.append(context_vector)
-
-    return context_vectors
+    name_encodes = get_name_encode_cv_sparse_v1(bandit_arm_dict, all_columns, context_size, uniqueness,
+                                                includes).toarray()
+    return [name_encode[:, None] for name_encode in name_encodes]
 
 
 def get_derived_value_cv_v4(connection, bandit_arm_dict, query_obj_list, chosen_arms_last_round,
-                            with_includes):
+                            with_includes, database_size=None):
     """
     Similar to the v2, but it don't have the is_include part
 
@@ -490,16 +851,18 @@ def get_derived_value_cv_v4(connection, bandit_arm_dict, query_obj_list, chosen_
     :param query_obj_list: list of queries
     :param chosen_arms_last_round: Already created arms
     :param with_includes: have is include feature, note if includes are added to encode part we don't need it here.
+    :param database_size: size of the database in MB, queried when not given
     :return: list of context vectors
     """
     context_vectors = []
     high_reward_value = 2
     high_reward_threshold = 100     # depends on DB size
-    database_size = sql_helper.get_database_size(connection)
+    if database_size is None:
+        database_size = sql_helper.get_database_size(connection)
     for key, bandit_arm in bandit_arm_dict.items():
         keys_last_round = set(chosen_arms_last_round.keys())
         is_high_reward_arm = high_reward_value if (bandit_arm.clustered_index_time > high_reward_threshold and bandit_arm.is_include) else 0
-        if bandit_arm.index_name not in keys_last_round:
+        if bandit_arm.arm_index not in keys_last_round:
             index_size = bandit_arm.memory
         else:
             index_size = 0
@@ -513,37 +876,180 @@ def get_derived_value_cv_v4(connection, bandit_arm_dict, query_obj_list, chosen_
     return context_vectors
 
 
-def get_view_encode_cv_v1(connection, bandit_arm_dict, all_columns, number_of_columns, chosen_arms_last_round):
+def get_derived_value_matrix_v1(connection, bandit_arm_dict, chosen_arms_last_round, with_includes,
+                                database_size=None, context_matrix=None):
+    """
+    Matrix version of get_derived_value_cv_v4, writes the derived values of all arms (high reward flag, size ratio and
+    include flag) in to the first STATIC_CONTEXT_SIZE columns of a context matrix, one row per arm
+
+    :param connection: SQL connection
+    :param bandit_arm_dict: bandit arms
+    :param chosen_arms_last_round: Already created arms
+    :param with_includes: have is include feature, note if includes are added to encode part we don't need it here.
+    :param database_size: size of the database in MB, queried when not given
+    :param context_matrix: matrix to write in to, a (number of arms x STATIC_CONTEXT_SIZE) matrix is created if None
+    :return: context matrix
+    """
+    high_reward_value = 2
+    high_reward_threshold = 100     # depends on DB size
+    if database_size is None:
+        database_size = sql_helper.get_database_size(connection)
+    number_of_arms = len(bandit_arm_dict)
+    if context_matrix is None:
+        context_matrix = numpy.zeros((number_of_arms, constants.STATIC_CONTEXT_SIZE))
+    bandit_arms = bandit_arm_dict.values()
+    clustered_index_times = numpy.fromiter((arm.clustered_index_time for arm in bandit_arms), float, number_of_arms)
+    is_include = numpy.fromiter((arm.is_include for arm in bandit_arms), float, number_of_arms)
+    index_sizes = numpy.fromiter((0 if arm.arm_index in chosen_arms_last_round else arm.memory
+                                  for arm in bandit_arms), float, number_of_arms)
+    context_matrix[:, 0] = numpy.where((clustered_index_times > high_reward_threshold) & (is_include != 0),
+                                       high_reward_value, 0)
+    context_matrix[:, 1] = index_sizes / database_size
+    if with_includes:
+        context_matrix[:, 2] = is_include
+    return context_matrix
+
+
+def get_index_context_matrix_v1(connection, bandit_arm_dict, all_columns, context_size, chosen_arms_last_round,
+                                with_includes, database_size=None, uniqueness=0, includes=False):
+    """
+    Dense context matrix of the index arms of a table, the derived values and the name encodes are written straight
+    in to one preallocated (number of arms x context size) matrix that the bandit uses as it is
+
+    :param connection: SQL connection
+    :param bandit_arm_dict: bandit arms
+    :param all_columns: predicate dict(list)
+    :param context_size: number of columns, size of one encode block
+    :param chosen_arms_last_round: Already created arms
+    :param with_includes: have is include feature in the derived values
+    :param database_size: size of the database in MB, queried when not given
+    :param uniqueness: how many columns in the index to consider when considering the context
+    :param includes: add includes to the arm encode
+    :return: (number of arms x context size) matrix
+    """
+    name_encodes = get_name_encode_cv_sparse_v1(bandit_arm_dict, all_columns, context_size, uniqueness, includes)
+    context_matrix = numpy.zeros((name_encodes.shape[0], constants.STATIC_CONTEXT_SIZE + name_encodes.shape[1]))
+    get_derived_value_matrix_v1(connection, bandit_arm_dict, chosen_arms_last_round, with_includes, database_size,
+                                context_matrix)
+    rows = numpy.repeat(numpy.arange(name_encodes.shape[0]), numpy.diff(name_encodes.indptr))
+    context_matrix[rows, constants.STATIC_CONTEXT_SIZE + name_encodes.indices] = name_encodes.data
+    return context_matrix
+
+
+def get_view_encode_cv_v1(connection, bandit_arm_dict, all_columns, number_of_columns, chosen_arms_last_round,
+                          database_size=None):
     """
-    Return the context vectors for a given view.
+    Return the contexts for a given views, as one (number of arms x context size) matrix written from the cached
+    sparse rows of the arms
 
     :param connection: SQL connection
     :param bandit_arm_dict: bandit arms
     :param all_columns: predicate dict(list)
     :param number_of_columns: number of columns in the database
     :param chosen_arms_last_round: Already created arms
-    :return: list of context vectors
+    :param database_size: size of the database in MB, queried when not given
+    :return: (number of arms x context size) matrix
     """
-    context_vectors = []
-    for key, bandit_arm in bandit_arm_dict.items():
-        context_vector = get_context_vector_mv_v1(connection, bandit_arm, all_columns, number_of_columns,
-                                                  chosen_arms_last_round)
-        context_vectors.append(context_vector)
+    return get_view_encode_cv_sparse_v1(connection, bandit_arm_dict, all_columns, number_of_columns,
+                                        chosen_arms_last_round, database_size).toarray()
 
-    return context_vectors
+
+def get_name_encode_cv_sparse_v1(bandit_arm_dict, all_columns, context_size, uniqueness=0, includes=False):
+    """
+    Sparse version of get_name_encode_cv_v2, return the name encodes of all given arms as one CSR matrix. The matrix
+    is assembled directly from the cached rows of the arms
+
+    :param bandit_arm_dict: bandit arms
+    :param all_columns: predicate dict(list)
+    :param context_size: size of the context vector
+    :param uniqueness: how many columns in the index to consider when considering the context
+    :param includes: add includes to the arm encode
+    :return: (number of arms x encode size) CSR matrix
+    """
+    context_vectors = [get_context_vector_sparse_v1(bandit_arm, all_columns, context_size, uniqueness, includes)
+                       for bandit_arm in bandit_arm_dict.values()]
+    return stack_sparse_rows(context_vectors, (uniqueness + 1 + int(includes)) * context_size)
 
 
-def get_super_bandit_context(connection, chosen_arms, chosen_arms_last_round, static_context_size, number_of_clusters):
+def stack_sparse_rows(context_vectors, context_size):
+    """
+    Stacks single row CSR matrices in to one CSR matrix, straight from their index and data arrays
+
+    :param context_vectors: list of (1 x context size) CSR matrices
+    :param context_size: number of columns
+    :return: (number of rows x context size) CSR matrix
+    """
+    if not context_vectors:
+        return scipy.sparse.csr_matrix((0, context_size))
+    indptr = numpy.concatenate(([0], numpy.cumsum([context_vector.nnz for context_vector in context_vectors])))
+    return scipy.sparse.csr_matrix((numpy.concatenate([context_vector.data for context_vector in context_vectors]),
+                                    numpy.concatenate([context_vector.indices for context_vector in context_vectors]),
+                                    indptr), shape=(len(context_vectors), context_size))
+
+
+def get_index_cv_sparse_v1(derived_contexts, name_encoded_contexts):
+    """
+    Combines the derived values and the sparse name encodes in to the CSR context matrix consumed by the sparse bandit
+
+    :param derived_contexts: (number of arms x STATIC_CONTEXT_SIZE) matrix of derived values
+    :param name_encoded_contexts: CSR matrix of name encodes
+    :return: (number of arms x context size) CSR matrix
+    """
+    return scipy.sparse.hstack([scipy.sparse.csr_matrix(derived_contexts), name_encoded_contexts], format='csr')
+
+
+def get_view_encode_cv_sparse_v1(connection, bandit_arm_dict, all_columns, number_of_columns, chosen_arms_last_round,
+                                 database_size=None):
+    """
+    Sparse version of get_view_encode_cv_v1, return the contexts of all given views as one CSR matrix
+
+    :param connection: SQL connection
+    :param bandit_arm_dict: bandit arms
+    :param all_columns: predicate dict(list)
+    :param number_of_columns: number of columns in the database
+    :param chosen_arms_last_round: Already created arms
+    :param database_size: size of the database in MB, queried when not given
+    :return: (number of arms x context size) CSR matrix
+    """
+    context_vectors = [get_context_vector_mv_sparse_v1(connection, bandit_arm, all_columns, number_of_columns,
+                                                       chosen_arms_last_round, database_size)
+                       for bandit_arm in bandit_arm_dict.values()]
+    return stack_sparse_rows(context_vectors, get_mv_context_size(len(all_columns), number_of_columns))
+
+
+def get_super_bandit_context(connection, chosen_arms, chosen_arms_last_round, static_context_size, number_of_clusters,
+                             database_size=None):
+    """
+    Arms chosen by the table and MV bandits and their super bandit contexts, written in to one preallocated matrix.
+    Each row has the size ratio (MV or index position, see get_super_arm_context_v1) and the UCB of the arm in the
+    position of its bandit cluster
+
+    :param connection: SQL connection
+    :param chosen_arms: chosen arms of each bandit, table name -> index name -> (arm, arm id, ucb)
+    :param chosen_arms_last_round: Already created arms
+    :param static_context_size: number of static values in the super context
+    :param number_of_clusters: number of bandit clusters
+    :param database_size: size of the database in MB, queried when not given
+    :return: list of arms, (number of arms x context size) matrix, list of (table name, arm id)
+    """
+    if database_size is None:
+        database_size = sql_helper.get_database_size(connection)
     original_map = []
     arm_list = []
-    context_list = []
+    ucbs = []
     for table, super_arm in chosen_arms.items():
         for key, (arm, arm_id, ucb) in super_arm.items():
             if arm.memory > 0:
                 arm_list.append(arm)
-                context_list.append(get_super_arm_context_v1(connection, arm, ucb, chosen_arms_last_round, static_context_size, number_of_clusters))
+                ucbs.append(ucb)
                 original_map.append((table, arm_id))
-    return arm_list, context_list, original_map
+
+    context_matrix = numpy.zeros((len(arm_list), static_context_size + number_of_clusters))
+    for i, arm in enumerate(arm_list):
+        index_size = 0 if arm.arm_index in chosen_arms_last_round else arm.memory
+        context_matrix[i, 0 if isinstance(arm, BanditArmMV) else 1] = index_size / database_size
+        context_matrix[i, static_context_size + arm.bandit_cluster] = ucbs[i]
+    return arm_list, context_matrix, original_map
 
 # ========================== Reward Calculation ==========================
 
@@ -564,26 +1070,29 @@ def calculate_reward(creation_cost, queries, query_plans):
         if query_plans[i]:
             query_rewards = get_query_rewards(queries[i], query_plans[i])
 
-            # Add them to full set
+            # Add them to full set, plans name the indexes, the name is converted to the arm id once here
             for index_name, reward in query_rewards.items():
-                if index_name not in arm_rewards:
-                    arm_rewards[index_name] = Reward()
-                    arm_rewards[index_name].execution = reward.execution
-                    arm_rewards[index_name].maintenance = reward.maintenance
-                    arm_rewards[index_name].offset = reward.offset
-                    arm_rewards[index_name].queries = {queries[i].id, }
+                arm_index = arm_indexes.get(index_name)
+                if arm_index is None:
+                    continue
+                if arm_index not in arm_rewards:
+                    arm_rewards[arm_index] = Reward()
+                    arm_rewards[arm_index].execution = reward.execution
+                    arm_rewards[arm_index].maintenance = reward.maintenance
+                    arm_rewards[arm_index].offset = reward.offset
+                    arm_rewards[arm_index].queries = {queries[i].id, }
                 else:
-                    arm_rewards[index_name].execution += reward.execution
-                    arm_rewards[index_name].maintenance += reward.maintenance
-                    arm_rewards[index_name].offset += reward.offset
-                    arm_rewards[index_name].queries.add(queries[i].id)
-
-    for index_name in creation_cost:
-        if index_name in arm_rewards:
-            arm_rewards[index_name].creation += -1 * creation_cost[index_name]
+                    arm_rewards[arm_index].execution += reward.execution
+                    arm_rewards[arm_index].maintenance += reward.maintenance
+                    arm_rewards[arm_index].offset += reward.offset
+                    arm_rewards[arm_index].queries.add(queries[i].id)
+
+    for arm_index in creation_cost:
+        if arm_index in arm_rewards:
+            arm_rewards[arm_index].creation += -1 * creation_cost[arm_index]
         else:
-            arm_rewards[index_name] = Reward()
-            arm_rewards[index_name].creation = -1 * creation_cost[index_name]
+            arm_rewards[arm_index] = Reward()
+            arm_rewards[arm_index].creation = -1 * creation_cost[arm_index]
     return arm_rewards
 
 
@@ -711,19 +1220,22 @@ def calculate_hyp_reward(queries, query_plans):
         if query_plans[i]:
             query_rewards = get_hyp_query_rewards(queries[i], query_plans[i])
 
-            # Add them to full set
+            # Add them to full set, plans name the indexes, the name is converted to the arm id once here
             for index_name, reward in query_rewards.items():
-                if index_name not in arm_rewards:
-                    arm_rewards[index_name] = Reward()
-                    arm_rewards[index_name].execution = reward.execution
-                    arm_rewards[index_name].maintenance = reward.maintenance
-                    arm_rewards[index_name].offset = reward.offset
-                    arm_rewards[index_name].queries = {queries[i].id, }
+                arm_index = arm_indexes.get(index_name)
+                if arm_index is None:
+                    continue
+                if arm_index not in arm_rewards:
+                    arm_rewards[arm_index] = Reward()
+                    arm_rewards[arm_index].execution = reward.execution
+                    arm_rewards[arm_index].maintenance = reward.maintenance
+                    arm_rewards[arm_index].offset = reward.offset
+                    arm_rewards[arm_index].queries = {queries[i].id, }
                 else:
-                    arm_rewards[index_name].execution += reward.execution
-                    arm_rewards[index_name].maintenance += reward.maintenance
-                    arm_rewards[index_name].offset += reward.offset
-                    arm_rewards[index_name].queries.add(queries[i].id)
+                    arm_rewards[arm_index].execution += reward.execution
+                    arm_rewards[arm_index].maintenance += reward.maintenance
+                    arm_rewards[arm_index].offset += reward.offset
+                    arm_rewards[arm_index].queries.add(queries[i].id)
 
     return arm_rewards
 
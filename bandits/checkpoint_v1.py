@@ -0,0 +1,58 @@
+import logging
+import os
+import pickle
+
+import numpy
+
+CHECKPOINT_VERSION = 5
+SUPER_BANDIT = 'SUPER'
+
+
+def save_checkpoint(file_path, current_round, bandits_dict, super_bandit, simulation_state):
+    """
+    Writes the state of the full bandit hierarchy at the end of a round. Bandit matrices are stored as plain arrays in
+    a npz file, arm store, query store, arm catalog, table subset index and the rest of the simulation state are
+    pickled in to a single byte array (one pickle, so shared arm objects stay shared after loading). The file is written to a temp file and then moved,
+    so a crash while writing never leaves a broken checkpoint behind.
+
+    :param file_path: path of the checkpoint file
+    :param current_round: round that just finished
+    :param bandits_dict: per table bandits and the MV bandit
+    :param super_bandit: super bandit
+    :param simulation_state: dictionary of python objects (arm store, query store, arm catalog, loop variables)
+    """
+    arrays = {'version': numpy.array(CHECKPOINT_VERSION), 'round': numpy.array(current_round)}
+    for bandit_name, bandit in list(bandits_dict.items()) + [(SUPER_BANDIT, super_bandit)]:
+        for key, value in bandit.get_state().items():
+            arrays[f'{bandit_name}/{key}'] = value
+    arrays['objects'] = numpy.frombuffer(pickle.dumps(simulation_state, protocol=pickle.HIGHEST_PROTOCOL),
+                                         dtype=numpy.uint8)
+
+    temp_file_path = file_path + '.tmp'
+    with open(temp_file_path, 'wb') as f:
+        numpy.savez(f, **arrays)
+    os.replace(temp_file_path, file_path)
+    logging.debug(f"Checkpoint written for round {current_round}")
+
+
+def load_checkpoint(file_path):
+    """
+    Reads a checkpoint written by save_checkpoint. The simulation state is a pickle, so only load checkpoints written
+    by this tool (trusted files), loading a pickle can run arbitrary code
+
+    :param file_path: path of the checkpoint file
+    :return: round number, dictionary of bandit states (bandit name -> state), simulation state
+    """
+    with numpy.load(file_path) as checkpoint:
+        version = int(checkpoint['version'])
+        if version != CHECKPOINT_VERSION:
+            raise Exception(f'Unsupported checkpoint version {version}, expected {CHECKPOINT_VERSION}')
+        current_round = int(checkpoint['round'])
+        bandit_states = {}
+        for key in checkpoint.files:
+            if '/' in key:
+                bandit_name, state_key = key.rsplit('/', 1)
+                bandit_states.setdefault(bandit_name, {})[state_key] = checkpoint[key]
+        simulation_state = pickle.loads(checkpoint['objects'].tobytes())
+    logging.info(f"Checkpoint loaded for round {current_round}")
+    return current_round, bandit_states, simulation_state
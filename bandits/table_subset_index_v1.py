@@ -0,0 +1,109 @@
+import bandits.bandit_helper_v1 as bandit_helper
+
+
+class TableSubsetIndex:
+    """
+    Inverted index from table subsets to the queries of the window that contain and can join them. Join graphs of a
+    query template never change, so the connected subsets of a template are enumerated once when it enters the window
+    and removed from the index when it leaves. The support of a subset changes with the window, so subsets are not
+    pruned when they are enumerated, they are pruned when they are counted every round. The same tables joined in
+    different templates are one subset (keyed by the frozenset of tables), its tuple keeps the table order of the first
+    template that added it, not the order of each query.
+    """
+
+    def __init__(self, query_properties):
+        self.query_properties = query_properties
+        self.query_subsets = {}     # query id -> connected table subsets (tuples, in query table order)
+        self.subset_queries = {}    # frozenset of tables -> query ids in the window
+        self.subset_tuples = {}     # frozenset of tables -> table subset tuple used as the key everywhere else
+        self.frequent_subsets = {}  # frozenset of tables -> (rank, table subset tuple) of this round
+
+    def update_window(self, query_objs):
+        """
+        Adds the queries that entered the window and removes the ones that left it
+
+        :param query_objs: queries in the current window
+        """
+        window_query_ids = {query_obj.id for query_obj in query_objs}
+        for query_id in [query_id for query_id in self.query_subsets if query_id not in window_query_ids]:
+            self.remove_query(query_id)
+        for query_id in window_query_ids:
+            if query_id not in self.query_subsets:
+                self.add_query(query_id)
+
+    def add_query(self, query_id):
+        """
+        Enumerates the connected table subsets of a query and adds them to the index
+
+        :param query_id: query id
+        """
+        table_set = list(dict.fromkeys(self.query_properties['tables'][query_id]))
+        adjacency = bandit_helper.get_join_adjacency(table_set, self.query_properties['joins'][query_id])
+        table_subsets = [tuple(table_set[i] for i in bandit_helper.get_mask_positions(mask))
+                         for mask in bandit_helper.gen_connected_subgraphs(adjacency)]
+        self.query_subsets[query_id] = table_subsets
+        for table_subset in table_subsets:
+            subset_key = frozenset(table_subset)
+            if subset_key not in self.subset_queries:
+                self.subset_queries[subset_key] = set()
+                self.subset_tuples[subset_key] = table_subset
+            self.subset_queries[subset_key].add(query_id)
+
+    def remove_query(self, query_id):
+        """
+        Removes a query from the index
+
+        :param query_id: query id
+        """
+        for table_subset in self.query_subsets.pop(query_id):
+            subset_key = frozenset(table_subset)
+            self.subset_queries[subset_key].discard(query_id)
+            if not self.subset_queries[subset_key]:
+                del self.subset_queries[subset_key]
+                del self.subset_tuples[subset_key]
+
+    def count_table_subsets(self, query_objs, min_support=0):
+        """
+        Workload time of the table subsets in the index that reach min_support. A subset is only counted if each of its
+        tables reaches min_support in the queries that contain the table. A subset is never used by more queries than
+        any of its tables, so this skips no frequent subset.
+
+        :param query_objs: queries in the current window
+        :param min_support: minimum workload time of a subset
+        :return: dict of table subsets (tuples) to workload time
+        """
+        running_times = {query_obj.id: query_obj.original_running_time for query_obj in query_objs}
+        table_times = {}
+        for query_id, running_time in running_times.items():
+            for table_name in set(self.query_properties['tables'][query_id]):
+                table_times[table_name] = table_times.get(table_name, 0) + running_time
+        frequent_tables = {table_name for table_name, table_time in table_times.items() if table_time >= min_support}
+
+        subset_times = {}
+        for subset_key, query_ids in self.subset_queries.items():
+            if subset_key <= frequent_tables:
+                subset_time = sum(running_times[query_id] for query_id in query_ids)
+                if subset_time >= min_support:
+                    subset_times[self.subset_tuples[subset_key]] = subset_time
+        return subset_times
+
+    def set_frequent_subsets(self, frequent_table_subsets):
+        """
+        Sets the frequent table subsets of this round
+
+        :param frequent_table_subsets: frequent table subsets, most frequent first
+        """
+        self.frequent_subsets = {frozenset(table_subset): (rank, table_subset)
+                                 for rank, table_subset in enumerate(frequent_table_subsets)}
+
+    def get_frequent_query_subsets(self, query_id):
+        """
+        Frequent table subsets the query contains and can join, only the subsets of the query are looked at
+
+        :param query_id: query id
+        :return: list of table subsets, most frequent first
+        """
+        frequent_subsets = [self.frequent_subsets[frozenset(table_subset)]
+                            for table_subset in self.query_subsets.get(query_id, [])
+                            if frozenset(table_subset) in self.frequent_subsets]
+        return [table_subset for _, table_subset in sorted(frequent_subsets)]
@@ -5,6 +5,8 @@ import os
 DB_CONFIG = '\config\db.conf'
 EXPERIMENT_FOLDER = '\experiments'
 WORKLOADS_FOLDER = '\\resources\\workloads'
+CARDINALITY_CACHE_FOLDER = '\\resources\\cardinality_cache'
+METADATA_SNAPSHOT_FOLDER = '\\resources\\metadata_snapshot'
 EXPERIMENT_CONFIG = '\config\exp.conf'
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 LOGGING_LEVEL = logging.INFO
@@ -17,10 +19,20 @@ TABLE_SCAN_TIME_LENGTH = 1000
 SCHEMA_NAME = 'dbo'
 SERVER_RESTART = True
 RESTORE_BACKUP = False
+DATABASE_STATISTICS_CACHE = True  # serve database and PDS size from memory, adjusted by the arms created and dropped
 
 # ===============================  Arm Generation Heuristics  ===============================
 INDEX_INCLUDES = 1
 SMALL_TABLE_IGNORE = 10001
+INDEX_ARM_BUDGET = 50  # max key column permutations generated per table and query, 0 generates all of them
+SELECTIVITY_SAMPLE_ROWS = 10000  # rows sampled when estimating the selectivity of a key column
+ARM_STORE_MAX_AGE = 50  # rounds an unused arm is kept in the arm store, 0 keeps arms forever
+ARM_STORE_MAX_MEMORY = 1024  # MB, least recently used arms are evicted above this, 0 for no cap
+MV_ESTIMATION_WORKERS = 4  # connections used to count the rows of new MV arms concurrently, 1 counts them serially
+MV_ESTIMATION_TIMEOUT = 60  # seconds a MV row count can run before it is cancelled
+MV_GROUP_BY_ROW_ESTIMATE = False  # group by MVs use the optimizer row estimate of the view query instead of a count
+MV_LAZY_FINALIZATION = False  # estimate the size of new MV arms only when the MV bandit ranks them as candidates
+MV_FINALIZATION_CANDIDATES = 10  # MV arms with the highest upper bound considered for size estimation per round
 
 # ===============================  Bandit Parameters  ===============================
 ALPHA_REDUCTION_RATE = 1.05
@@ -28,6 +40,15 @@ QUERY_MEMORY = 1
 MAX_INDEXES_PER_TABLE = 10
 CREATION_COST_REDUCTION_FACTOR = 4
 UNIFORM_ASSUMPTION_START = 10
+SELECTION_WORKERS = 1   # > 1 runs table bandit selection in a thread pool, only the numpy scoring runs in parallel
+CHECKPOINT_BANDITS = False  # write the bandit hierarchy to a checkpoint file at the end of every round
+RESUME_FROM_CHECKPOINT = False  # continue from the last checkpoint of the experiment, if there is one
+BANDIT_C3UCB = 'C3UCB'
+BANDIT_C3UCB_SLIDING_WINDOW = 'C3UCB_SLIDING_WINDOW'
+BANDIT_LIN_TS = 'LIN_TS'
+BANDIT_ALGORITHM = BANDIT_C3UCB
+BANDIT_BANK = False  # keep the table bandits (C3UCB, dense contexts only) in one C3UCBBank, scored and updated together
+SLIDING_WINDOW_ROUNDS = 10  # rounds of history kept by the sliding window bandit
 
 # ===============================  Reward Related  ===============================
 COST_TYPE_ELAPSED_TIME = 'act_elapsed_max'
@@ -40,6 +61,8 @@ UNCLAIMED_REWARD_DISTRIBUTION = True
 CONTEXT_UNIQUENESS = 0
 CONTEXT_INCLUDES = False
 STATIC_CONTEXT_SIZE = 3
+SPARSE_CONTEXT = False  # keep index and MV contexts as sparse rows (C3UCBSparse), cheaper for wide schemas
+MV_CONTEXT_DIMENSION = 0  # > 0 hashes the table and column encode of MV contexts in to this many positions
 
 # ===============================  PDS Selection  ===============================
 VIEW_ONLY = 'VIEW_ONLY'
@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import database.sql_connection as sql_connection
+
+
+class SQLConnectionPool:
+    """
+    Fixed size pool of SQL connections with one worker thread per connection. Each worker opens its own connection the
+    first time it runs a task and keeps it, so tasks submitted to the pool never share a connection.
+    """
+
+    def __init__(self, size, timeout=0, connection_factory=sql_connection.get_sql_connection):
+        """
+        :param size: number of connections (and worker threads)
+        :param timeout: query timeout set on every connection in seconds, 0 for no timeout
+        :param connection_factory: function that opens a new connection
+        """
+        self.size = size
+        self.timeout = timeout
+        self.connection_factory = connection_factory
+        self.executor = ThreadPoolExecutor(size, thread_name_prefix='sql_pool')
+        self.connections = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get_connection(self):
+        """
+        Connection of the current worker thread, opened on first use
+
+        :return: connection
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.connection_factory()
+            connection.timeout = self.timeout
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def submit(self, function, *args):
+        """
+        Runs function(connection, *args) on one of the pool connections
+
+        :param function: function to run, gets the connection as the first argument
+        :return: future of the function result
+        """
+        return self.executor.submit(self.run, function, *args)
+
+    def run(self, function, *args):
+        return function(self.get_connection(), *args)
+
+    def close(self):
+        """
+        Stops the workers (tasks not started yet are dropped) and closes the connections
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for connection in self.connections:
+            sql_connection.close_sql_connection(connection)
+        self.connections = []
@@ -1,12 +1,18 @@
+import concurrent.futures
 import configparser
 import copy
 import datetime
+import hashlib
+import json
 import logging
 import os
 import subprocess
+import threading
 import time
 from collections import defaultdict
 
+import numpy
+
 import constants
 from database.column import Column
 from database.qplan.query_plan import QueryPlan
@@ -21,9 +27,18 @@ table_scan_times_hyp = copy.deepcopy(constants.TABLE_SCAN_TIMES[database[:-4]])
 table_scan_times = copy.deepcopy(constants.TABLE_SCAN_TIMES[database[:-4]])
 
 tables_global = None
+METADATA_SNAPSHOT_VERSION = 1
 pk_columns_dict = {}
-count_numbers = {}
+column_selectivity = {}
+column_length_arrays = {}
+count_numbers = {}     # MV row counts, cache key (get_mv_count_query) -> rows, successful counts persisted per database
+count_cache_file = None
+count_cache_fingerprint = None
+count_cache_dirty = False
 cache_hits = 0
+database_size_cache = None  # data size in MB (sp_spaceused), None until it is read from the database
+pds_size_cache = None       # used size of all physical design structures in MB, None until it is read
+applied_arm_sizes = {}      # arm name -> (used size in MB, is MV) added to the cached sizes by bulk_create
 
 
 # ############################# TA functions #############################
@@ -42,6 +57,7 @@ def create_index_v2(connection, query):
     stat_xml = cursor.fetchone()[0]
     cursor.execute("SET STATISTICS XML OFF")
     connection.commit()
+    invalidate_database_statistics()
 
     # Return the current reward
     query_plan = QueryPlan.get_plan(stat_xml)
@@ -60,6 +76,7 @@ def create_view_v1(connection, query):
     cursor.execute(query)
     cursor.execute("SET STATISTICS XML OFF")
     connection.commit()
+    invalidate_database_statistics()
 
     return 0
 
@@ -75,6 +92,7 @@ def simple_execute(connection, query):
     cursor = connection.cursor()
     cursor.execute(query)
     connection.commit()
+    invalidate_database_statistics()
     logging.debug(query)
 
 
@@ -146,8 +164,8 @@ def bulk_create(connection, schema_name, bandit_arm_list):
 
         :param connection: sql_connection
         :param schema_name: name of the database schema
-        :param bandit_arm_list: list of BanditArm objects
-        :return: cost (regret)
+        :param bandit_arm_list: dict of arm_index -> BanditArm objects, names are only used for the DDL
+        :return: cost (regret) per arm_index
     """
     cost = {}
     for name, bandit_arm in bandit_arm_list.items():
@@ -155,29 +173,35 @@ def bulk_create(connection, schema_name, bandit_arm_list):
             cost[name] = create_view(connection, bandit_arm.index_name, bandit_arm.view_query,
                                      bandit_arm.index_query)
             if cost[name]:
-                set_arm_size_mv(connection, bandit_arm)
+                update_database_statistics(bandit_arm.index_name, set_arm_size_mv(connection, bandit_arm), True)
+            else:
+                # the view is there without its clustered index, it takes no space
+                update_database_statistics(bandit_arm.index_name, 0, True)
         else:
             cost[name] = create_index_v1(connection, schema_name, bandit_arm.table_name, bandit_arm.index_cols,
                                          bandit_arm.index_name,
                                          bandit_arm.include_cols)
-            set_arm_size(connection, bandit_arm)
+            update_database_statistics(bandit_arm.index_name, set_arm_size(connection, bandit_arm), False)
     return cost
 
 
-def bulk_drop(connection, schema_name, bandit_arm_list, file=None):
+def bulk_drop(connection, schema_name, bandit_arm_list, file=None, is_hypothetical=False):
     """
     Drops the index for all given bandit arms
 
     :param connection: sql_connection
     :param schema_name: name of the database schema
     :param bandit_arm_list: list of bandit arms
+    :param is_hypothetical: arms are hypothetical indexes, they take no space so the cached sizes are not changed
     :return:
     """
     for name, bandit_arm in bandit_arm_list.items():
         if type(bandit_arm).__name__ == 'BanditArmMV':
-            drop_view(connection, schema_name, name, file)
+            drop_view(connection, schema_name, bandit_arm.index_name, file)
         else:
             drop_index(connection, schema_name, bandit_arm.table_name, bandit_arm.index_name, file)
+        if not is_hypothetical:
+            remove_database_statistics(bandit_arm.index_name)
 
 
 def create_index_v1(connection, schema_name, tbl_name, col_names, idx_name, include_cols=()):
@@ -330,7 +354,7 @@ def hyp_check_config(connection, schema_name, arm_list_to_add, queries, file_pat
         cost += exe_cost
         if query.first_seen == query.last_seen:
             query.original_hyp_running_time = query_plan.sub_tree_cost
-    bulk_drop(connection, schema_name, arm_list_to_add, file)
+    bulk_drop(connection, schema_name, arm_list_to_add, file, is_hypothetical=True)
     file.close()
 
     return query_plans, cost
@@ -548,14 +572,22 @@ def get_table_columns(connection, table_name):
 
 def get_current_pds_size(connection):
     """
-    Get the current size of all the physical design structures
+    Get the current size of all the physical design structures. The size is read from the database once and then
+    served from memory, bulk_create and bulk_drop keep it up to date.
     :param connection: SQL Connection
     :return: size of all the physical design structures in MB
     """
+    global pds_size_cache
+    if constants.DATABASE_STATISTICS_CACHE and pds_size_cache is not None:
+        return pds_size_cache
     query = '''SELECT (SUM(s.[used_page_count]) * 8)/1024.0 AS size_mb FROM sys.dm_db_partition_stats AS s'''
     cursor = connection.cursor()
     cursor.execute(query)
-    return cursor.fetchone()[0]
+    pds_size = cursor.fetchone()[0]
+    if constants.DATABASE_STATISTICS_CACHE:
+        pds_size_cache = float(pds_size)
+        return pds_size_cache
+    return pds_size
 
 
 def get_primary_key(connection, schema_name, table_name):
@@ -583,6 +615,27 @@ def get_primary_key(connection, schema_name, table_name):
     return pk_columns
 
 
+def get_column_selectivity(connection, schema_name, table_name, column_name):
+    """
+    Estimated selectivity of an equality predicate on a column (1 / number of distinct values), taken from the first
+    rows of the table. Only used to rank key columns, so the estimate is cached for the whole run
+
+    :param connection: SQL Connection
+    :param schema_name: schema name of table
+    :param table_name: table name
+    :param column_name: column name
+    :return: selectivity between 0 and 1
+    """
+    if (table_name, column_name) not in column_selectivity:
+        query = f"""SELECT COUNT(DISTINCT {column_name})
+                FROM (SELECT TOP ({constants.SELECTIVITY_SAMPLE_ROWS}) {column_name} FROM {schema_name}.{table_name}) T"""
+        cursor = connection.cursor()
+        cursor.execute(query)
+        distinct_values = cursor.fetchone()[0]
+        column_selectivity[(table_name, column_name)] = 1 / distinct_values if distinct_values else 1
+    return column_selectivity[(table_name, column_name)]
+
+
 def get_column_data_length_v2(connection, table_name, col_names):
     """
     get the data length of given set of columns
@@ -668,26 +721,167 @@ def get_tables(connection):
     :return: Table dictionary with table name as the key
     """
     global tables_global
-    if tables_global is not None:
-        return tables_global
-    else:
-        tables = {}
-        get_tables_query = """SELECT TABLE_NAME
-                                FROM INFORMATION_SCHEMA.TABLES
-                                WHERE TABLE_TYPE = 'BASE TABLE'"""
-        cursor = connection.cursor()
-        cursor.execute(get_tables_query)
-        results = cursor.fetchall()
-        for result in results:
-            table_name = result[0]
-            row_count = get_table_row_count(connection, constants.SCHEMA_NAME, table_name)
-            pk_columns = get_primary_key(connection, constants.SCHEMA_NAME, table_name)
-            tables[table_name] = Table(table_name, row_count, pk_columns)
-            tables[table_name].set_columns(get_columns(connection, table_name))
-        tables_global= tables
+    if tables_global is None:
+        fingerprint = get_metadata_fingerprint(connection)
+        tables_global = load_metadata_snapshot(fingerprint)
+        if tables_global is None:
+            tables_global = load_tables(connection, constants.SCHEMA_NAME)
+            save_metadata_snapshot(tables_global, fingerprint)
     return tables_global
 
 
+def get_metadata_fingerprint(connection):
+    """
+    Cheap fingerprint of the schema and data of the user tables: checksums over the columns (name, type, length), the
+    primary keys and the row counts of the tables. Indexes and views created by the tuner do not change it.
+
+    :param connection: SQL Connection
+    :return: fingerprint string
+    """
+    query = """SELECT (SELECT CHECKSUM_AGG(CHECKSUM(C.object_id, C.column_id, C.name, C.system_type_id, C.max_length))
+                        FROM sys.columns C JOIN sys.tables T ON C.object_id = T.object_id),
+                      (SELECT CHECKSUM_AGG(CHECKSUM(K.parent_object_id, K.name))
+                        FROM sys.key_constraints K WHERE K.type = 'PK'),
+                      (SELECT CHECKSUM_AGG(CHECKSUM(P.object_id, P.partition_number, P.rows))
+                        FROM sys.partitions P JOIN sys.tables T ON P.object_id = T.object_id
+                        WHERE P.index_id IN (0, 1)),
+                      (SELECT SUM(P.rows)
+                        FROM sys.partitions P JOIN sys.tables T ON P.object_id = T.object_id
+                        WHERE P.index_id IN (0, 1))"""
+    cursor = connection.cursor()
+    cursor.execute(query)
+    result = cursor.fetchone()
+    return f"{db_config[db_type]['server']}/{database}/" + '/'.join(str(value) for value in result)
+
+
+def get_metadata_snapshot_file():
+    """
+    :return: path of the metadata snapshot of the current database
+    """
+    snapshot_folder = constants.ROOT_DIR + constants.METADATA_SNAPSHOT_FOLDER
+    os.makedirs(snapshot_folder, exist_ok=True)
+    return snapshot_folder + '\\' + database + '.json'
+
+
+def load_metadata_snapshot(fingerprint):
+    """
+    Loads the tables saved by save_metadata_snapshot, if the snapshot has the current version and fingerprint
+
+    :param fingerprint: current metadata fingerprint (get_metadata_fingerprint)
+    :return: Table dictionary with table name as the key, None if there is no valid snapshot
+    """
+    snapshot_file = get_metadata_snapshot_file()
+    if not os.path.exists(snapshot_file):
+        return None
+    with open(snapshot_file) as f:
+        snapshot = json.load(f)
+    if snapshot['version'] != METADATA_SNAPSHOT_VERSION or snapshot['fingerprint'] != fingerprint:
+        logging.info(f"Metadata snapshot {snapshot_file} is out of date, reloading the catalog")
+        return None
+
+    tables = {}
+    for table_name, table_snapshot in snapshot['tables'].items():
+        if table_name not in pk_columns_dict:
+            pk_columns_dict[table_name] = table_snapshot['pk_columns']
+        tables[table_name] = Table(table_name, table_snapshot['row_count'], pk_columns_dict[table_name])
+        columns = {}
+        for col_name, column_type, column_size, max_column_size in table_snapshot['columns']:
+            columns[col_name] = Column(table_name, col_name, column_type)
+            columns[col_name].set_column_size(column_size)
+            columns[col_name].set_max_column_size(max_column_size)
+        tables[table_name].set_columns(columns)
+    logging.info(f"Loaded metadata of {len(tables)} tables from {snapshot_file}")
+    return tables
+
+
+def save_metadata_snapshot(tables, fingerprint):
+    """
+    Saves the tables (row counts, primary keys and columns) so the next run can skip loading the catalog
+
+    :param tables: Table dictionary with table name as the key
+    :param fingerprint: metadata fingerprint the tables were loaded with
+    """
+    snapshot = {'version': METADATA_SNAPSHOT_VERSION, 'fingerprint': fingerprint, 'tables': {}}
+    for table_name, table in tables.items():
+        snapshot['tables'][table_name] = {
+            'row_count': table.table_row_count,
+            'pk_columns': table.pk_columns,
+            'columns': [[column.column_name, column.column_type, column.column_size, column.max_column_size]
+                        for column in table.columns.values()]}
+    snapshot_file = get_metadata_snapshot_file()
+    temp_file_path = snapshot_file + '.tmp'
+    with open(temp_file_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temp_file_path, snapshot_file)
+
+
+def load_tables(connection, schema_name):
+    """
+    Loads the catalog of all tables in a few set based queries instead of a chain of queries per table: row counts,
+    primary keys, columns with their types and lengths, and one batched query sampling the average length of every
+    varchar column (first 1000 rows of each table, same as get_columns)
+
+    :param connection: SQL Connection
+    :param schema_name: schema name of the tables
+    :return: Table dictionary with table name as the key
+    """
+    tables = {}
+    cursor = connection.cursor()
+    row_count_query = f"""SELECT T.TABLE_NAME, (SELECT SUM(P.rows)
+                                                 FROM sys.partitions P
+                                                 WHERE P.index_id IN (0, 1)
+                                                 AND P.object_id = OBJECT_ID('{schema_name}.' + T.TABLE_NAME))
+                            FROM INFORMATION_SCHEMA.TABLES T
+                            WHERE T.TABLE_TYPE = 'BASE TABLE'"""
+    cursor.execute(row_count_query)
+    row_counts = {result[0]: result[1] for result in cursor.fetchall()}
+
+    pk_query = f"""SELECT TABLE_NAME, COLUMN_NAME
+                FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+                WHERE OBJECTPROPERTY(OBJECT_ID(CONSTRAINT_SCHEMA + '.' + QUOTENAME(CONSTRAINT_NAME)), 'IsPrimaryKey') = 1
+                AND TABLE_SCHEMA = '{schema_name}'
+                ORDER BY TABLE_NAME, ORDINAL_POSITION"""
+    cursor.execute(pk_query)
+    pk_columns = defaultdict(list)
+    for result in cursor.fetchall():
+        pk_columns[result[0]].append(result[1])
+    for table_name, row_count in row_counts.items():
+        if table_name not in pk_columns_dict:
+            pk_columns_dict[table_name] = pk_columns[table_name]
+        tables[table_name] = Table(table_name, row_count, pk_columns_dict[table_name])
+        tables[table_name].set_columns({})
+
+    data_type_query = """SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, COL_LENGTH(TABLE_NAME, COLUMN_NAME)
+                        FROM INFORMATION_SCHEMA.COLUMNS
+                        ORDER BY TABLE_NAME, ORDINAL_POSITION"""
+    cursor.execute(data_type_query)
+    varchar_ids = defaultdict(list)
+    for table_name, col_name, data_type, col_length in cursor.fetchall():
+        if table_name not in tables:
+            continue
+        column = Column(table_name, col_name, data_type)
+        column.set_max_column_size(int(col_length))
+        if data_type != 'varchar':
+            column.set_column_size(int(col_length))
+        else:
+            varchar_ids[table_name].append(col_name)
+        tables[table_name].columns[col_name] = column
+
+    if varchar_ids:
+        # one row per varchar column, the columns of each table are unpivoted over its sampled rows
+        variable_len_segments = []
+        for table_name, col_names in varchar_ids.items():
+            values = ', '.join(f"('{col_name}', DATALENGTH(T.{col_name}))" for col_name in col_names)
+            variable_len_segments.append(f"""SELECT '{table_name}', V.COLUMN_NAME, AVG(V.DL)
+                        FROM (SELECT TOP (1000) {', '.join(col_names)} FROM {table_name}) T
+                        CROSS APPLY (VALUES {values}) V(COLUMN_NAME, DL)
+                        GROUP BY V.COLUMN_NAME""")
+        cursor.execute('\nUNION ALL\n'.join(variable_len_segments))
+        for table_name, col_name, avg_length in cursor.fetchall():
+            tables[table_name].columns[col_name].set_column_size(avg_length)
+    return tables
+
+
 def get_table_list(connection, min_row_count):
     """
     Get the list of names of tables with more rows then the minimum row count
@@ -696,25 +890,9 @@ def get_table_list(connection, min_row_count):
     :param min_row_count: minimum row count
     :return: table name list (list of Strings)
     """
-    global tables_global
-    if tables_global is None:
-        tables = {}
-        get_tables_query = """SELECT TABLE_NAME
-                                    FROM INFORMATION_SCHEMA.TABLES
-                                    WHERE TABLE_TYPE = 'BASE TABLE'"""
-        cursor = connection.cursor()
-        cursor.execute(get_tables_query)
-        results = cursor.fetchall()
-        for result in results:
-            table_name = result[0]
-            row_count = get_table_row_count(connection, constants.SCHEMA_NAME, table_name)
-            pk_columns = get_primary_key(connection, constants.SCHEMA_NAME, table_name)
-            tables[table_name] = Table(table_name, row_count, pk_columns)
-            tables[table_name].set_columns(get_columns(connection, table_name))
-        tables_global = tables
-
+    tables = get_tables(connection)
     table_name_list = []
-    for table_name, table in tables_global.items():
+    for table_name, table in tables.items():
         if table.table_row_count > min_row_count:
             table_name_list.append(table_name)
     return table_name_list
@@ -731,26 +909,21 @@ def get_estimated_size_of_mv_v2(connection, payload, mv_query, count_query, coun
     :return: estimated size in MB
     """
     # Except for the estimated number of rows, rest of the calculation looks accurate.
-    # Bit hard to think of a better way to estimate the number of rows
-    # estimated_rows = QueryPlan.get_plan(get_query_plan_xml(connection, mv_query)).estimated_rows
-    global count_numbers
-    global cache_hits
-    if count_query_id in count_numbers and not is_gb:
-        estimated_rows = count_numbers[count_query_id]
-        cache_hits += 1
-    else:
-        try:
-            cursor = connection.cursor()
-            cursor.execute(count_query)
-            result = cursor.fetchone()
-            estimated_rows = result[0]
-            if not is_gb:
-                count_numbers[count_query_id] = estimated_rows
-        except:
-            if not is_gb:
-                count_numbers[count_query_id] = -1
-            estimated_rows = -1
+    # Group by views can use the optimizer estimate of the view query instead of counting (MV_GROUP_BY_ROW_ESTIMATE)
+    key, count_query_job = get_mv_count_query(mv_query, count_query, count_query_id, is_gb)
+    estimated_rows = get_mv_row_counts(connection, {key: count_query_job}, constants.MV_ESTIMATION_TIMEOUT)[key]
+    return get_estimated_size_of_mv_rows(connection, payload, estimated_rows)
+
+
+def get_estimated_size_of_mv_rows(connection, payload, estimated_rows):
+    """
+    Estimated size of a MV with the given number of rows, from the data length of the payload columns
 
+    :param connection: sql_connection
+    :param payload: payload of the MV query
+    :param estimated_rows: number of rows in the MV, -1 if the count failed
+    :return: estimated size in MB, -1 if there is no row count
+    """
     if estimated_rows > 0:
         tables = set(payload.keys())
         total_row_length = 0
@@ -771,6 +944,189 @@ def get_estimated_size_of_mv_v2(connection, payload, mv_query, count_query, coun
         return -1
 
 
+def get_mv_count_query(mv_query, count_query, count_query_id, is_gb):
+    """
+    Query that gives the row count of a MV and its key in the count cache. Join only views with the same fact tables
+    have the same row count, so they share the key. Group by views are keyed by their normalised query, and use the
+    optimizer row estimate of the view query when MV_GROUP_BY_ROW_ESTIMATE is set.
+
+    :param mv_query: select query of the MV
+    :param count_query: COUNT_BIG query of the MV
+    :param count_query_id: fact tables of the MV
+    :param is_gb: MV has a group by
+    :return: cache key, (query, True if the row count is read from the showplan of the query)
+    """
+    if is_gb and constants.MV_GROUP_BY_ROW_ESTIMATE:
+        return 'estimate: ' + normalise_query(mv_query), (mv_query, True)
+    elif is_gb:
+        return normalise_query(count_query), (count_query, False)
+    return ','.join(count_query_id), (count_query, False)
+
+
+def normalise_query(query):
+    """
+    Query text with case and white space normalised, view queries have no string literals
+
+    :param query: sql query
+    :return: normalised query
+    """
+    return ' '.join(query.lower().split())
+
+
+def get_mv_row_counts(connection, count_queries, timeout, connection_pool=None):
+    """
+    Row counts of MVs, read from the count cache or else run on the connection. With a connection pool, the queries are
+    run concurrently, so a round waits on the slowest count instead of the sum of them. A query running for more than
+    timeout seconds gets -1, same as a failed query. New counts are added to the count cache.
+
+    :param connection: sql_connection, used when there is no connection pool
+    :param count_queries: dict of cache key to (query, estimate) from get_mv_count_query
+    :param timeout: per query deadline in seconds, 0 for no deadline
+    :param connection_pool: SQLConnectionPool to run the queries concurrently
+    :return: dict of cache key to row count (-1 if the count failed or timed out)
+    """
+    global cache_hits
+    global count_cache_dirty
+    load_count_cache(connection)
+    row_counts = {}
+    futures = {}
+    running_cursors = {}    # cache key -> (cursor, start time) of the queries running now
+    lock = threading.Lock()
+
+    def run_count_query(query_connection, key, count_query, estimate):
+        cursor = query_connection.cursor()
+        with lock:
+            running_cursors[key] = (cursor, time.monotonic())
+        try:
+            if estimate:
+                cursor.execute("SET SHOWPLAN_XML ON;")
+                try:
+                    cursor.execute(count_query)
+                    return QueryPlan.get_plan(cursor.fetchone()[0]).estimated_rows
+                finally:
+                    cursor.execute("SET SHOWPLAN_XML OFF;")
+            cursor.execute(count_query)
+            return cursor.fetchone()[0]
+        finally:
+            with lock:
+                running_cursors.pop(key, None)
+
+    for key, (count_query, estimate) in count_queries.items():
+        if key in count_numbers:
+            row_counts[key] = count_numbers[key]
+            cache_hits += 1
+        elif connection_pool is None:
+            connection.timeout = timeout
+            try:
+                row_counts[key] = run_count_query(connection, key, count_query, estimate)
+            except Exception as e:
+                logging.debug(f"MV count failed: {e}")
+                row_counts[key] = -1
+            connection.timeout = 0
+        else:
+            futures[connection_pool.submit(run_count_query, key, count_query, estimate)] = key
+
+    pending = set(futures)
+    cancelled = {}          # cache key -> time the query was cancelled
+    while pending:
+        wait_time = None
+        if timeout > 0:
+            with lock:
+                deadlines = [start_time + timeout for key, (_, start_time) in running_cursors.items()
+                             if key not in cancelled]
+            deadlines += [cancel_time + timeout for key, cancel_time in cancelled.items() if key not in row_counts]
+            wait_time = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+        done, pending = concurrent.futures.wait(pending, timeout=wait_time,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                row_counts[futures[future]] = future.result()
+            except Exception as e:
+                logging.debug(f"MV count failed: {e}")
+                row_counts[futures[future]] = -1
+        if timeout > 0:
+            now = time.monotonic()
+            with lock:
+                timed_out = [(key, cursor) for key, (cursor, start_time) in running_cursors.items()
+                             if key not in cancelled and now - start_time >= timeout]
+            for key, cursor in timed_out:
+                # the worker gets an error from the cancelled query and its connection is reused. The future is still
+                # waited for, a query that returned just before the cancel keeps its row count
+                cursor.cancel()
+                cancelled[key] = now
+            for future in pending:
+                key = futures[future]
+                if key in cancelled and now - cancelled[key] >= timeout:
+                    logging.debug(f"MV count did not stop after the cancel: {key}")
+                    row_counts[key] = -1
+            pending = {future for future in pending if futures[future] not in row_counts}
+
+    for key in count_queries:
+        if key not in count_numbers:
+            # failed and timed out counts are kept for this run only, save_count_cache does not write them
+            count_numbers[key] = row_counts[key]
+            if row_counts[key] >= 0:
+                count_cache_dirty = True
+    return row_counts
+
+
+def get_database_fingerprint(connection):
+    """
+    Identity of the database and its data, the server, database name and the row count of every table. MV row counts
+    are only valid for the same fingerprint.
+
+    :param connection: sql_connection
+    :return: fingerprint string
+    """
+    tables = get_tables(connection)
+    table_rows = ','.join(f'{table_name}:{tables[table_name].table_row_count}' for table_name in sorted(tables))
+    identity = f"{db_config[db_type]['server']}/{database}/{table_rows}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def load_count_cache(connection):
+    """
+    Loads the MV row counts saved by earlier runs on the same database, once per process. Counts saved for a different
+    fingerprint (data changed) are dropped.
+
+    :param connection: sql_connection
+    """
+    global count_cache_file
+    global count_cache_fingerprint
+    if count_cache_file is not None:
+        return
+    count_cache_fingerprint = get_database_fingerprint(connection)
+    cache_folder = constants.ROOT_DIR + constants.CARDINALITY_CACHE_FOLDER
+    os.makedirs(cache_folder, exist_ok=True)
+    count_cache_file = cache_folder + '\\' + database + '.json'
+    if os.path.exists(count_cache_file):
+        with open(count_cache_file) as f:
+            count_cache = json.load(f)
+        if count_cache['fingerprint'] == count_cache_fingerprint:
+            for key, rows in count_cache['counts'].items():
+                if rows >= 0:
+                    count_numbers.setdefault(key, rows)
+            logging.info(f"Loaded {len(count_cache['counts'])} MV row counts from {count_cache_file}")
+        else:
+            logging.info(f"MV row count cache {count_cache_file} is for different data, ignored")
+
+
+def save_count_cache():
+    """
+    Writes the MV row counts to the count cache file, if there are new counts. Only successful counts are written, a
+    count that failed or timed out (-1) is tried again in the next run
+    """
+    global count_cache_dirty
+    if count_cache_file is None or not count_cache_dirty:
+        return
+    counts = {key: rows for key, rows in count_numbers.items() if rows >= 0}
+    temp_file_path = count_cache_file + '.tmp'
+    with open(temp_file_path, 'w') as f:
+        json.dump({'fingerprint': count_cache_fingerprint, 'counts': counts}, f)
+    os.replace(temp_file_path, count_cache_file)
+    count_cache_dirty = False
+
+
 def get_estimated_size_of_index_v1(connection, schema_name, tbl_name, col_names):
     """
     This helper method can be used to get a estimate size for a index. This simply multiply the column sizes with a
@@ -782,22 +1138,76 @@ def get_estimated_size_of_index_v1(connection, schema_name, tbl_name, col_names)
     :param col_names: string list of column names
     :return: estimated size in MB
     """
-    table = get_tables(connection)[tbl_name]
+    return get_estimated_sizes_of_indexes(connection, schema_name, tbl_name, [col_names])[0]
+
+
+def get_estimated_sizes_of_indexes(connection, schema_name, tbl_name, col_names_list):
+    """
+    Batch version of get_estimated_size_of_index_v1, estimates the size of many indexes on the same table at once. The
+    columns of each index are a row of a 0/1 matrix over the table columns, so the row lengths, varchar counts and the
+    1700 byte key limit are matrix vector products with the column length arrays of the table
+
+    :param connection: sql_connection
+    :param schema_name: name of the database schema
+    :param tbl_name: name of the database table
+    :param col_names_list: list of column name lists, one per index
+    :return: numpy array of estimated sizes in MB
+    """
+    column_positions, column_sizes, max_column_sizes, is_varchar, is_pk = get_column_length_arrays(connection,
+                                                                                                  schema_name,
+                                                                                                  tbl_name)
     header_size = 6
     nullable_buffer = 2
-    primary_key = get_primary_key(connection, schema_name, tbl_name)
-    primary_key_size = get_column_data_length_v2(connection, tbl_name, primary_key)
-    col_not_pk = tuple(set(col_names) - set(primary_key))
-    key_columns_length = get_column_data_length_v2(connection, tbl_name, col_not_pk)
+    index_columns = numpy.zeros((len(col_names_list), len(column_positions)))
+    for i, col_names in enumerate(col_names_list):
+        index_columns[i, [column_positions[column_name] for column_name in col_names]] = 1
+
+    primary_key_size = get_data_length_from_arrays(is_pk, column_sizes, is_varchar)
+    key_columns_length = get_data_length_from_arrays(index_columns * (1 - is_pk), column_sizes, is_varchar)
     index_row_length = header_size + primary_key_size + key_columns_length + nullable_buffer
-    row_count = table.table_row_count
-    estimated_size = row_count * index_row_length
-    estimated_size = estimated_size/float(1024*1024)
-    max_column_length = get_max_column_data_length_v2(connection, tbl_name, col_names)
-    if max_column_length > 1700:
-        print(f'Index going past 1700: {col_names}')
-        estimated_size = 99999999
-    return estimated_size
+    estimated_sizes = get_tables(connection)[tbl_name].table_row_count * index_row_length / float(1024 * 1024)
+
+    past_key_limit = index_columns @ max_column_sizes > 1700
+    for i in numpy.flatnonzero(past_key_limit):
+        print(f'Index going past 1700: {col_names_list[i]}')
+    estimated_sizes[past_key_limit] = 99999999
+    return estimated_sizes
+
+
+def get_data_length_from_arrays(columns, column_sizes, is_varchar):
+    """
+    Vectorized get_column_data_length_v2, data length of column sets given as 0/1 rows over the table columns
+
+    :param columns: 0/1 array (one row per column set, or a single row)
+    :param column_sizes: average data length of each column
+    :param is_varchar: 0/1 array, column is a varchar
+    :return: data length of each column set
+    """
+    varchar_count = columns @ is_varchar
+    return columns @ column_sizes + numpy.where(varchar_count > 0, 2 + varchar_count * 2, 0)
+
+
+def get_column_length_arrays(connection, schema_name, tbl_name):
+    """
+    Column lengths of a table as arrays in the column order of the table, built once per table
+
+    :param connection: sql_connection
+    :param schema_name: name of the database schema
+    :param tbl_name: name of the database table
+    :return: column name -> position, data lengths, max data lengths, 0/1 varchar flags, 0/1 primary key flags
+    """
+    if tbl_name not in column_length_arrays:
+        columns = get_tables(connection)[tbl_name].columns
+        primary_key = set(get_primary_key(connection, schema_name, tbl_name))
+        column_positions = {column_name: i for i, column_name in enumerate(columns)}
+        column_sizes = numpy.array([column.column_size if column.column_size else 0 for column in columns.values()],
+                                   dtype=float)
+        max_column_sizes = numpy.array([column.max_column_size if column.max_column_size else 0
+                                        for column in columns.values()], dtype=float)
+        is_varchar = numpy.array([column.column_type == 'varchar' for column in columns.values()], dtype=float)
+        is_pk = numpy.array([column_name in primary_key for column_name in columns], dtype=float)
+        column_length_arrays[tbl_name] = (column_positions, column_sizes, max_column_sizes, is_varchar, is_pk)
+    return column_length_arrays[tbl_name]
 
 
 def get_query_plan_xml(connection, query):
@@ -831,6 +1241,8 @@ def remove_all_non_clustered(connection, schema_name):
     for result in results:
         if not result[0].startswith('UQ_'):
             drop_index(connection, schema_name, result[1], result[0])
+    applied_arm_sizes.clear()
+    invalidate_database_statistics()
 
 
 def get_table_scan_times_structure():
@@ -858,7 +1270,15 @@ def drop_statistic(connection, table_name, stat_name):
 
 
 def set_arm_size(connection, bandit_arm):
-    query = f"""SELECT (SUM(s.[used_page_count]) * 8)/1024 AS IndexSizeMB
+    """
+    Sets the size of the index in whole MB as the arm memory
+
+    :param connection: SQL Connection
+    :param bandit_arm: Bandit arm for the index
+    :return: exact used size of the index in MB, for the cached PDS size
+    """
+    query = f"""SELECT (SUM(s.[used_page_count]) * 8)/1024 AS IndexSizeMB,
+                    (SUM(s.[used_page_count]) * 8)/1024.0 AS UsedSizeMB
                 FROM sys.dm_db_partition_stats AS s
                 INNER JOIN sys.indexes AS i ON s.[object_id] = i.[object_id]
                     AND s.[index_id] = i.[index_id]
@@ -870,19 +1290,20 @@ def set_arm_size(connection, bandit_arm):
     cursor.execute(query)
     result = cursor.fetchone()
     bandit_arm.memory = result[0]
-    return bandit_arm
+    return float(result[1])
 
 
 def set_arm_size_mv(connection, bandit_arm):
     """
-    Returns the size of the MV in MB
+    Sets the size of the MV in whole MB (total pages) as the arm memory
     :param connection: SQL Connection
     :param bandit_arm: Bandit arm for the MV
-    :return: int size (in MB)
+    :return: exact used size of the MV in MB (used pages like get_current_pds_size), for the cached PDS size
     """
     query = f"""
         SELECT 
-            (SUM(a.total_pages) * 8)/1024 AS TotalSpaceMB
+            (SUM(a.total_pages) * 8)/1024 AS TotalSpaceMB,
+            (SUM(a.used_pages) * 8)/1024.0 AS UsedSpaceMB
         FROM 
             sys.views v
         INNER JOIN      
@@ -902,7 +1323,7 @@ def set_arm_size_mv(connection, bandit_arm):
     cursor.execute(query)
     result = cursor.fetchone()
     bandit_arm.memory = result[0]
-    return bandit_arm
+    return float(result[1])
 
 
 def restart_sql_server():
@@ -918,6 +1339,9 @@ def restart_sql_server():
 
 
 def get_database_size(connection):
+    global database_size_cache
+    if constants.DATABASE_STATISTICS_CACHE and database_size_cache is not None:
+        return database_size_cache
     database_size = 10240
     try:
         query = "exec sp_spaceused @oneresultset = 1;"
@@ -925,16 +1349,69 @@ def get_database_size(connection):
         cursor.execute(query)
         result = cursor.fetchone()
         database_size = float(result[4].split(" ")[0])/1024
+        if constants.DATABASE_STATISTICS_CACHE:
+            database_size_cache = database_size
     except Exception as e:
         logging.error("Exception when get_database_size: " + str(e))
     return database_size
 
 
+def update_database_statistics(arm_name, memory, is_mv):
+    """
+    Adds a created arm to the cached database and PDS size. sp_spaceused counts the clustered index of an indexed view
+    as data, so only MVs change the database size, while every arm changes the PDS size. The size added is remembered,
+    so remove_database_statistics takes away the same size when the arm is dropped. If the arm size is not known the
+    cache is invalidated and the sizes are read again on the next call.
+
+    :param arm_name: name of the index or view
+    :param memory: size of the created arm in MB, None if the size is not known
+    :param is_mv: True if the arm is a materialised view
+    """
+    global database_size_cache, pds_size_cache
+    if memory is None:
+        invalidate_database_statistics()
+        return
+    applied_arm_sizes[arm_name] = (memory, is_mv)
+    if pds_size_cache is not None:
+        pds_size_cache += memory
+    if is_mv and database_size_cache is not None:
+        database_size_cache += memory
+
+
+def remove_database_statistics(arm_name):
+    """
+    Takes a dropped arm out of the cached database and PDS size. Arms that were not created by bulk_create in this run
+    have no known size, the cache is invalidated for them
+
+    :param arm_name: name of the index or view
+    """
+    global database_size_cache, pds_size_cache
+    if arm_name not in applied_arm_sizes:
+        invalidate_database_statistics()
+        return
+    memory, is_mv = applied_arm_sizes.pop(arm_name)
+    if pds_size_cache is not None:
+        pds_size_cache -= memory
+    if is_mv and database_size_cache is not None:
+        database_size_cache -= memory
+
+
+def invalidate_database_statistics():
+    """
+    Drops the cached database and PDS size, used when the database is changed outside bulk_create and bulk_drop
+    """
+    global database_size_cache, pds_size_cache
+    database_size_cache = None
+    pds_size_cache = None
+
+
 def clean_up_routine(sql_connection):
     # restart server. We need to do this before restore to remove all connections
     if constants.SERVER_RESTART:
         restart_sql_server()
 
+    applied_arm_sizes.clear()
+    invalidate_database_statistics()
     master_connection = sql_connection.get_master_sql_connection()
 
     # restore the backup
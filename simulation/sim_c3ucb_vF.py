@@ -1,23 +1,29 @@
 import datetime
 import logging
 import operator
+import os
 import pprint
+from concurrent.futures import Future, ThreadPoolExecutor
 from importlib import reload
 
-import numpy
 from pandas import DataFrame
 
+import bandits.bandit_arm_v1 as bandit_arm
 import bandits.bandit_c2ucb_v1 as bandits
 import bandits.bandit_helper_v1 as bandit_helper
+import bandits.checkpoint_v1 as checkpoint
 import constants as constants
 import database.sql_connection as sql_connection
 import shared.configs_v2 as configs
 import shared.helper_v2 as helper
+from bandits.arm_catalog_v1 import ArmCatalog
 from bandits.experiment_report import ExpReport
 from bandits.oracleMV_v3 import OracleV1 as OracleMV
 from bandits.oracle_super import OracleV1 as OracleS
 from bandits.oracle_v1 import OracleV1 as Oracle
 from bandits.query_v1 import Query
+from bandits.table_subset_index_v1 import TableSubsetIndex
+from database.sql_connection_pool import SQLConnectionPool
 from database.sql_helper_factory import SQLHelperFactory
 
 # First per table bandit
@@ -61,24 +67,47 @@ class Simulator(BaseSimulator):
 
         # reset hyp query log
         hyp_file_path = helper.get_experiment_folder_path(configs.experiment_id) + configs.experiment_id + '_hyp.sql'
+        checkpoint_file_path = helper.get_experiment_folder_path(
+            configs.experiment_id) + configs.experiment_id + '_checkpoint.npz'
+        last_round, bandit_states, simulation_state = -1, {}, None
+        if constants.RESUME_FROM_CHECKPOINT and os.path.isfile(checkpoint_file_path):
+            last_round, bandit_states, simulation_state = checkpoint.load_checkpoint(checkpoint_file_path)
 
         # Get all the columns from the database
         bandits_dict = {}
         columns = {}
         column_counts = {}
 
-        configs.max_memory -= int(sql_helper.get_current_pds_size(self.connection))
+        if simulation_state:
+            # created PDSs are still there, so we can't take the memory budget from the current PDS size
+            configs.max_memory = simulation_state['max_memory']
+        else:
+            configs.max_memory -= int(sql_helper.get_current_pds_size(self.connection))
+        context_bandit = bandits.get_bandit_class(constants.BANDIT_ALGORITHM, constants.SPARSE_CONTEXT)
+        if constants.BANDIT_BANK and constants.BANDIT_ALGORITHM != constants.BANDIT_C3UCB:
+            raise Exception(f'Bandit bank only supports {constants.BANDIT_C3UCB}')
+        if constants.BANDIT_BANK and constants.SPARSE_CONTEXT:
+            raise Exception('Bandit bank does not support sparse contexts')
         # Creating bandits for tables
         cluster_id = 1
+        table_context_sizes = []
         for table_name in table_list:
             columns[table_name], column_counts[table_name] = sql_helper.get_table_columns(self.connection, table_name)
             context_size = column_counts[table_name] * (
                     1 + constants.CONTEXT_UNIQUENESS + constants.CONTEXT_INCLUDES) + constants.STATIC_CONTEXT_SIZE
+            table_context_sizes.append(context_size)
 
             # Create oracle and the bandit
-            oracle = Oracle(configs.max_memory)
-            bandits_dict[table_name] = bandits.C3UCB(context_size, configs.input_alpha, configs.input_lambda, oracle,
-                                                     cluster_id)
+            if not constants.BANDIT_BANK:
+                oracle = Oracle(configs.max_memory)
+                bandits_dict[table_name] = context_bandit(context_size, configs.input_alpha, configs.input_lambda,
+                                                          oracle, cluster_id)
+        bandit_bank = None
+        if constants.BANDIT_BANK:
+            bandit_bank = bandits.C3UCBBank(table_context_sizes, configs.input_alpha, configs.input_lambda,
+                                            [Oracle(configs.max_memory) for _ in table_list], cluster_id)
+            for table_name, bandit in zip(table_list, bandit_bank.members):
+                bandits_dict[table_name] = bandit
         cluster_id += 1
 
         tables = []
@@ -87,14 +116,16 @@ class Simulator(BaseSimulator):
             # Creating bandit for MVs
             all_columns, number_of_columns = sql_helper.get_all_columns(self.connection)
             tables = sql_helper.get_tables(self.connection)
-            context_size = number_of_columns + len(tables) + 4
-            bandits_dict[mv] = bandits.C3UCB(context_size, configs.input_alpha, configs.input_lambda,
-                                             OracleMV(configs.max_memory), cluster_id)
+            context_size = bandit_helper.get_mv_context_size(len(tables), number_of_columns)
+            bandits_dict[mv] = context_bandit(context_size, configs.input_alpha, configs.input_lambda,
+                                              OracleMV(configs.max_memory), cluster_id)
 
         # Creating super bandit
         number_of_clusters = cluster_id + 1
         oracle_s = OracleS(configs.max_memory)
-        super_bandit = bandits.C3UCB(number_of_clusters + super_static_context_size, configs.input_alpha, configs.input_lambda, oracle_s)
+        super_bandit_class = bandits.get_bandit_class(constants.BANDIT_ALGORITHM)
+        super_bandit = super_bandit_class(number_of_clusters + super_static_context_size, configs.input_alpha,
+                                          configs.input_lambda, oracle_s)
 
         # Running the bandit for T rounds and gather the reward
         arm_selection_count = {}
@@ -104,8 +135,40 @@ class Simulator(BaseSimulator):
         queries_end = configs.queries_end_list[next_workload_shift]
         query_obj_additions = []
         total_time = 0.0
-
-        for t in range(configs.rounds):
+        subset_index = TableSubsetIndex(self.query_properties)
+        arm_catalog = ArmCatalog(self.query_properties, subset_index)
+        executor = ThreadPoolExecutor(constants.SELECTION_WORKERS) if constants.SELECTION_WORKERS > 1 else None
+        # row counts of new MV arms run concurrently on their own connections
+        mv_connection_pool = None
+        if with_mv and constants.MV_ESTIMATION_WORKERS > 1:
+            mv_connection_pool = SQLConnectionPool(constants.MV_ESTIMATION_WORKERS, constants.MV_ESTIMATION_TIMEOUT)
+
+        if simulation_state:
+            for bandit_name, bandit_state in bandit_states.items():
+                if bandit_name == checkpoint.SUPER_BANDIT:
+                    super_bandit.set_state(bandit_state)
+                elif bandit_name in bandits_dict:
+                    bandits_dict[bandit_name].set_state(bandit_state)
+            bandit_helper.bandit_arm_store = simulation_state['bandit_arm_store']
+            bandit_arm.restore_arm_indexes(simulation_state['arm_indexes'])
+            bandit_arm.reset_interned_columns(bandit_helper.bandit_arm_store.values())
+            bandit_helper.table_scan_times = simulation_state['table_scan_times']
+            bandit_helper.sql_helper.column_selectivity.update(simulation_state['column_selectivity'])
+            subset_index = simulation_state['subset_index']
+            arm_catalog = simulation_state['arm_catalog']
+            subset_index.query_properties = arm_catalog.query_properties = self.query_properties
+            self.query_obj_store = simulation_state['query_obj_store']
+            arm_selection_count = simulation_state['arm_selection_count']
+            chosen_arms_last_round = simulation_state['chosen_arms_last_round']
+            next_workload_shift = simulation_state['next_workload_shift']
+            queries_start = simulation_state['queries_start']
+            queries_end = simulation_state['queries_end']
+            query_obj_additions = simulation_state['query_obj_additions']
+            total_time = simulation_state['total_time']
+            results = simulation_state['results']
+            logging.info(f"Resuming from round {last_round + 1}")
+
+        for t in range(last_round + 1, configs.rounds):
             logging.info(f"round: {t}")
             start_time_round = datetime.datetime.now()
             # At the start of the round we will read the applicable set for the current round. This is a workaround
@@ -118,6 +181,8 @@ class Simulator(BaseSimulator):
                 if len(configs.workload_shifts) > next_workload_shift + 1:
                     next_workload_shift += 1
 
+            bandit_helper.bandit_arm_store.start_round(t, chosen_arms_last_round)
+
             # New set of queries in this batch, required for query execution
             queries_current_batch = self.queries[queries_start:queries_end]
 
@@ -155,8 +220,11 @@ class Simulator(BaseSimulator):
             # workload change
             if t > 0 and len(query_obj_additions) > 0:
                 workload_change = len(query_obj_additions) / len(query_obj_list_past)
-                for table_name in table_list:
-                    bandits_dict[table_name].workload_change_trigger(workload_change)
+                if bandit_bank:
+                    bandit_bank.workload_change_trigger(workload_change)
+                else:
+                    for table_name in table_list:
+                        bandits_dict[table_name].workload_change_trigger(workload_change)
                 if with_mv:
                     bandits_dict[mv].workload_change_trigger(workload_change)
 
@@ -164,108 +232,60 @@ class Simulator(BaseSimulator):
             query_obj_additions = query_obj_list_new
 
             # Get the predicates, frequent table subsets for queries and Generate index and view arms for each query
-            index_arms = {}
             frequent_table_subsets = {}
             if with_mv:
                 frequent_table_subsets = bandit_helper.gen_frq_table_subsets(self.connection, query_obj_list_past, tables,
-                                                                             self.query_properties)
-            for i in range(len(query_obj_list_past)):
-                bandit_arms_tmp = bandit_helper.gen_arms_from_predicates_v2(self.connection, query_obj_list_past[i])
-                bandit_arms_mv = {}
-                if with_mv:
-                    bandit_arms_mv = bandit_helper.gen_mv_arms_from_predicates_v3(self.connection, query_obj_list_past[i],
-                                                                                  tables, frequent_table_subsets,
-                                                                                  self.query_properties, True)
-                    # bandit_arms_mv = bandit_helper.finalizing_mv_arms(self.connection, bandit_arms_mv)
-                # Adding index arms
-                for key, index_arm in bandit_arms_tmp.items():
-                    table_name = index_arm.table_name
-                    if table_name not in index_arms:
-                        index_arms[table_name] = {}
-                    if key not in index_arms[table_name]:
-                        index_arm.query_ids = set()
-                        index_arm.query_ids_backup = set()
-                        index_arm.clustered_index_time = 1
-                        index_arms[table_name][key] = index_arm
-                    # index_arm.clustered_index_time += max(
-                    #     query_obj_list_past[i].table_scan_times[index_arm.table_name]) if \
-                    #     query_obj_list_past[i].table_scan_times[index_arm.table_name] else 0
-                    index_arm.clustered_index_time += query_obj_list_past[i].original_running_time
-                    index_arms[table_name][key].query_ids.add(index_arm.query_id)
-                    index_arms[table_name][key].query_ids_backup.add(index_arm.query_id)
-
-                if with_mv:
-                    # Adding MV arms
-                    for key, index_arm in bandit_arms_mv.items():
-                        table_name = index_arm.table_name
-                        if table_name not in index_arms:
-                            index_arms[table_name] = {}
-                        if key not in index_arms[table_name]:
-                            index_arm.query_ids = set()
-                            index_arm.query_ids_backup = set()
-                            index_arm.clustered_index_time = 1
-                            index_arms[table_name][key] = index_arm
-                        for ta in index_arm.table_names:
-                            index_arm.clustered_index_time += max(
-                                query_obj_list_past[i].table_scan_times[ta]) if \
-                                query_obj_list_past[i].table_scan_times[ta] else 0
-                        index_arms[table_name][key].query_ids.add(index_arm.query_id)
-                        index_arms[table_name][key].query_ids_backup.add(index_arm.query_id)
+                                                                             self.query_properties, subset_index)
+            # arms are only generated for new query templates, the catalog reuses the arms of known templates
+            index_arms = arm_catalog.get_round_arms(self.connection, query_obj_list_past, tables,
+                                                    frequent_table_subsets, with_mv)
 
             # set the index arms at the bandit
-            if mv in index_arms:
-                bandit_helper.finalizing_mv_arms(self.connection, index_arms[mv], self.query_properties, configs.max_memory)
-            chosen_arms = {}
-            chosen_arm_ids = {}
+            database_size = sql_helper.get_database_size(self.connection)
+            if mv in index_arms and constants.MV_LAZY_FINALIZATION:
+                bandit_helper.finalizing_mv_arms_lazy(self.connection, bandits_dict[mv], index_arms[mv], all_columns,
+                                                      number_of_columns, chosen_arms_last_round, database_size,
+                                                      self.query_properties, configs.max_memory, mv_connection_pool)
+            elif mv in index_arms:
+                bandit_helper.finalizing_mv_arms(self.connection, index_arms[mv], self.query_properties, configs.max_memory,
+                                                 mv_connection_pool)
+            # per table bandits (and the MV bandit) are independent until the super bandit, so they can run in a pool.
+            # Context building and the oracles are python code that holds the GIL, only the upper bounds (numpy) run in
+            # parallel, a few percent of the selection time. The oracles change query_ids of the arms, which the super
+            # bandit reads, so they can not be moved to a process pool without sending the arms back and forth
+            selections = {}
+            # with the bank, only the contexts are built per table, arm scoring is done for all tables at once
+            select_table = self.get_table_contexts if bandit_bank else self.select_table_arms
             for table_name in table_list:
-                index_arms_for_table = {}
-                if table_name in index_arms:
-                    index_arms_for_table = index_arms[table_name]
-
-                index_arm_list = list(index_arms_for_table.values())
-                logging.info(f"Generated {len(index_arm_list)} arms for table {table_name}")
-                bandits_dict[table_name].set_arms(index_arm_list)
-
-                # creating the context, here we pass all the columns in the database
-                context_vectors_v1 = bandit_helper.get_name_encode_cv_v2(index_arms_for_table, columns[table_name], column_counts[table_name], constants.CONTEXT_UNIQUENESS, constants.CONTEXT_INCLUDES)
-                context_vectors_v2 = bandit_helper.get_derived_value_cv_v4(self.connection, index_arms_for_table, query_obj_list_past, chosen_arms_last_round, constants.INDEX_INCLUDES)
-
-                context_vectors = []
-                for i in range(len(context_vectors_v1)):
-                    context_vectors.append(
-                        numpy.array(list(context_vectors_v2[i]) + list(context_vectors_v1[i]), ndmin=2))
-                # getting the super arm from the bandit
-                chosen_arm_ids[table_name] = bandits_dict[table_name].select_arm(context_vectors, t)
-
-                # get objects for the chosen set of arm ids
-                if chosen_arm_ids[table_name]:
-                    for (arm_id, ucb) in chosen_arm_ids[table_name]:
-                        index_name = index_arm_list[arm_id].index_name
-                        if table_name not in chosen_arms:
-                            chosen_arms[table_name] = {}
-                        chosen_arms[table_name][index_name] = (index_arm_list[arm_id], arm_id, ucb)
-
-            # setting arms for MV bandit
+                index_arms_for_table = index_arms[table_name] if table_name in index_arms else {}
+                selection_args = (bandits_dict[table_name], table_name, index_arms_for_table, columns[table_name],
+                                  column_counts[table_name], query_obj_list_past, chosen_arms_last_round,
+                                  database_size, t)
+                if executor:
+                    selections[table_name] = executor.submit(select_table, *selection_args)
+                else:
+                    selections[table_name] = select_table(*selection_args)
+            if bandit_bank:
+                table_contexts = [selections[table_name].result() if executor else selections[table_name]
+                                  for table_name in table_list]
+                for table_name, chosen_arm_ids in zip(table_list, bandit_bank.select_arms(table_contexts, t)):
+                    selections[table_name] = self.get_chosen_arms(bandits_dict[table_name].arms, chosen_arm_ids)
             if with_mv:
-                index_arm_list = {}
-                index_arms_for_table = {}
-                if mv in index_arms:
-                    index_arm_list = list(index_arms[mv].values())
-                    index_arms_for_table = index_arms[mv]
-
-                logging.info(f"Generated {len(index_arm_list)} arms")
-                bandits_dict[mv].set_arms(index_arm_list)
-
-                context_vectors = bandit_helper.get_view_encode_cv_v1(self.connection, index_arms_for_table, all_columns,
-                                                                      number_of_columns, chosen_arms_last_round)
-                chosen_arm_ids[mv] = bandits_dict[mv].select_arm(context_vectors, t)
-                chosen_arms[mv] = {}
-                if chosen_arm_ids[mv]:
-                    for (arm_id, ucb) in chosen_arm_ids[mv]:
-                        index_name = index_arm_list[arm_id].index_name
-                        chosen_arms[mv][index_name] = (index_arm_list[arm_id], arm_id, ucb)
-
-            super_arm_list, super_context, original_map = bandit_helper.get_super_bandit_context(self.connection, chosen_arms, chosen_arms_last_round, super_static_context_size, number_of_clusters)
+                index_arms_for_table = index_arms[mv] if mv in index_arms else {}
+                selection_args = (bandits_dict[mv], index_arms_for_table, all_columns, number_of_columns,
+                                  chosen_arms_last_round, database_size, t)
+                if executor:
+                    selections[mv] = executor.submit(self.select_mv_arms, *selection_args)
+                else:
+                    selections[mv] = self.select_mv_arms(*selection_args)
+
+            chosen_arms = {}
+            for table_name, selection in selections.items():
+                chosen_arms_for_table = selection.result() if isinstance(selection, Future) else selection
+                if chosen_arms_for_table or table_name == mv:
+                    chosen_arms[table_name] = chosen_arms_for_table
+
+            super_arm_list, super_context, original_map = bandit_helper.get_super_bandit_context(self.connection, chosen_arms, chosen_arms_last_round, super_static_context_size, number_of_clusters, database_size)
             super_bandit.set_arms(super_arm_list)
             super_chosen_arm_ids, mv_size_weight, index_size_weight = super_bandit.select_super_arm_v2(super_context)
             super_chosen_per_table = {}
@@ -280,22 +300,22 @@ class Simulator(BaseSimulator):
             if super_chosen_arm_ids:
                 for arm_id in super_chosen_arm_ids:
                     index_name = super_arm_list[arm_id].index_name
-                    super_chosen_arms[index_name] = super_arm_list[arm_id]
+                    super_chosen_arms[super_arm_list[arm_id].arm_index] = super_arm_list[arm_id]
                     used_memory = used_memory + super_arm_list[arm_id].memory
                     if index_name in arm_selection_count:
                         arm_selection_count[index_name] += 1
                     else:
                         arm_selection_count[index_name] = 1
 
-            # finding the difference between last round and this round
+            # finding the difference between last round and this round, arms are keyed by arm_index
             keys_last_round = set(chosen_arms_last_round.keys())
             keys_this_round = set(super_chosen_arms.keys())
             key_intersection = keys_last_round & keys_this_round
             key_additions = keys_this_round - key_intersection
             key_deletions = keys_last_round - key_intersection
-            logging.info(f"Selected: {keys_this_round}")
-            logging.debug(f"Added: {key_additions}")
-            logging.debug(f"Removed: {key_deletions}")
+            logging.info(f"Selected: {set(arm.index_name for arm in super_chosen_arms.values())}")
+            logging.debug(f"Added: {set(super_chosen_arms[key].index_name for key in key_additions)}")
+            logging.debug(f"Removed: {set(chosen_arms_last_round[key].index_name for key in key_deletions)}")
 
             added_arms = {}
             deleted_arms = {}
@@ -319,7 +339,7 @@ class Simulator(BaseSimulator):
                 hyp_cost += (end_time_hyp_reward - start_time_hyp_reward).total_seconds()
                 useless = set(added_arms.keys()) - set(hyp_arm_rewards.keys())
                 for a_id in useless:
-                    logging.info(f"Suggestion Removed {a_id}")
+                    logging.info(f"Suggestion Removed {added_arms[a_id].index_name}")
                     del added_arms[a_id]
                     del super_chosen_arms[a_id]
 
@@ -333,9 +353,13 @@ class Simulator(BaseSimulator):
 
             super_bandit.update_super_v3(super_chosen_arm_ids, arm_rewards, useless, mv_size_weight, index_size_weight)
 
-            for table_name in table_list:
-                arm_ids = super_chosen_per_table[table_name] if (table_name in super_chosen_per_table) else []
-                bandits_dict[table_name].update(arm_ids, arm_rewards, useless, mv_size_weight, index_size_weight)
+            if bandit_bank:
+                bandit_bank.update([super_chosen_per_table.get(table_name, []) for table_name in table_list],
+                                   arm_rewards, useless, mv_size_weight, index_size_weight)
+            else:
+                for table_name in table_list:
+                    arm_ids = super_chosen_per_table[table_name] if (table_name in super_chosen_per_table) else []
+                    bandits_dict[table_name].update(arm_ids, arm_rewards, useless, mv_size_weight, index_size_weight)
 
             if with_mv:
                 arm_ids = super_chosen_per_table[mv] if (mv in super_chosen_per_table) else []
@@ -367,7 +391,30 @@ class Simulator(BaseSimulator):
 
             total_time += total_round_time
 
+            if constants.CHECKPOINT_BANDITS:
+                simulation_state = {'max_memory': configs.max_memory,
+                                    'bandit_arm_store': bandit_helper.bandit_arm_store,
+                                    'arm_indexes': bandit_arm.arm_indexes,
+                                    'table_scan_times': bandit_helper.table_scan_times,
+                                    'column_selectivity': bandit_helper.sql_helper.column_selectivity,
+                                    'subset_index': subset_index,
+                                    'arm_catalog': arm_catalog,
+                                    'query_obj_store': self.query_obj_store,
+                                    'arm_selection_count': arm_selection_count,
+                                    'chosen_arms_last_round': chosen_arms_last_round,
+                                    'next_workload_shift': next_workload_shift,
+                                    'queries_start': queries_start,
+                                    'queries_end': queries_end,
+                                    'query_obj_additions': query_obj_additions,
+                                    'total_time': total_time,
+                                    'results': results}
+                checkpoint.save_checkpoint(checkpoint_file_path, t, bandits_dict, super_bandit, simulation_state)
+
             print(f"current total {t}: ", total_time)
+        if executor:
+            executor.shutdown()
+        if mv_connection_pool:
+            mv_connection_pool.close()
         logging.info("Time taken by bandit for " + str(configs.rounds) + " rounds: " + str(total_time))
         logging.info("\n\nIndex Usage Counts:\n" + pp.pformat(
             sorted(arm_selection_count.items(), key=operator.itemgetter(1), reverse=True)))
@@ -376,6 +423,107 @@ class Simulator(BaseSimulator):
         self.connection = sql_connection.get_sql_connection()
         return results, total_time
 
+    @staticmethod
+    def select_table_arms(bandit, table_name, index_arms_for_table, table_columns, table_column_count,
+                          query_obj_list_past, chosen_arms_last_round, database_size, t):
+        """
+        Builds the contexts for the arms of a table and runs the table bandit
+
+        :param bandit: bandit of the table
+        :param table_name: name of the table
+        :param index_arms_for_table: index arms generated for the table (dict)
+        :param table_columns: columns of the table
+        :param table_column_count: number of columns in the table
+        :param query_obj_list_past: queries in the current window
+        :param chosen_arms_last_round: Already created arms
+        :param database_size: size of the database in MB
+        :param t: current round
+        :return: dict of chosen arms, index name -> (arm, arm id, ucb)
+        """
+        context_vectors = Simulator.get_table_contexts(bandit, table_name, index_arms_for_table, table_columns,
+                                                       table_column_count, query_obj_list_past,
+                                                       chosen_arms_last_round, database_size, t)
+        # getting the super arm from the bandit
+        chosen_arm_ids = bandit.select_arm(context_vectors, t)
+        return Simulator.get_chosen_arms(bandit.arms, chosen_arm_ids)
+
+    @staticmethod
+    def get_table_contexts(bandit, table_name, index_arms_for_table, table_columns, table_column_count,
+                           query_obj_list_past, chosen_arms_last_round, database_size, t):
+        """
+        Sets the arms of a table at the table bandit and builds their contexts
+
+        :param bandit: bandit of the table
+        :param table_name: name of the table
+        :param index_arms_for_table: index arms generated for the table (dict)
+        :param table_columns: columns of the table
+        :param table_column_count: number of columns in the table
+        :param query_obj_list_past: queries in the current window
+        :param chosen_arms_last_round: Already created arms
+        :param database_size: size of the database in MB
+        :param t: current round
+        :return: context vectors of the arms
+        """
+        index_arm_list = list(index_arms_for_table.values())
+        logging.info(f"Generated {len(index_arm_list)} arms for table {table_name}")
+        bandit.set_arms(index_arm_list)
+
+        # creating the context, here we pass all the columns in the database
+        if constants.SPARSE_CONTEXT:
+            context_vectors_v2 = bandit_helper.get_derived_value_matrix_v1(None, index_arms_for_table, chosen_arms_last_round, constants.INDEX_INCLUDES, database_size)
+            context_vectors_v1 = bandit_helper.get_name_encode_cv_sparse_v1(index_arms_for_table, table_columns, table_column_count, constants.CONTEXT_UNIQUENESS, constants.CONTEXT_INCLUDES)
+            context_vectors = bandit_helper.get_index_cv_sparse_v1(context_vectors_v2, context_vectors_v1)
+        else:
+            # derived values and name encodes are written in to one matrix, the bandit takes it as it is
+            context_vectors = bandit_helper.get_index_context_matrix_v1(None, index_arms_for_table, table_columns, table_column_count, chosen_arms_last_round, constants.INDEX_INCLUDES, database_size, constants.CONTEXT_UNIQUENESS, constants.CONTEXT_INCLUDES)
+        return context_vectors
+
+    @staticmethod
+    def get_chosen_arms(index_arm_list, chosen_arm_ids):
+        """
+        Get the arm objects for the arm ids chosen by a bandit
+
+        :param index_arm_list: arms of the bandit
+        :param chosen_arm_ids: list of (arm id, ucb) returned by the bandit
+        :return: dict of chosen arms, index name -> (arm, arm id, ucb)
+        """
+        chosen_arms = {}
+        if chosen_arm_ids:
+            for (arm_id, ucb) in chosen_arm_ids:
+                index_name = index_arm_list[arm_id].index_name
+                chosen_arms[index_name] = (index_arm_list[arm_id], arm_id, ucb)
+        return chosen_arms
+
+    @staticmethod
+    def select_mv_arms(bandit, index_arms_for_table, all_columns, number_of_columns, chosen_arms_last_round,
+                       database_size, t):
+        """
+        Builds the contexts for the MV arms and runs the MV bandit
+
+        :param bandit: MV bandit
+        :param index_arms_for_table: MV arms generated for this round (dict)
+        :param all_columns: all columns in the database
+        :param number_of_columns: number of columns in the database
+        :param chosen_arms_last_round: Already created arms
+        :param database_size: size of the database in MB
+        :param t: current round
+        :return: dict of chosen arms, index name -> (arm, arm id, ucb)
+        """
+        index_arm_list = list(index_arms_for_table.values())
+        logging.info(f"Generated {len(index_arm_list)} arms")
+        bandit.set_arms(index_arm_list)
+
+        if constants.SPARSE_CONTEXT:
+            context_vectors = bandit_helper.get_view_encode_cv_sparse_v1(None, index_arms_for_table, all_columns,
+                                                                         number_of_columns, chosen_arms_last_round,
+                                                                         database_size)
+        else:
+            context_vectors = bandit_helper.get_view_encode_cv_v1(None, index_arms_for_table, all_columns,
+                                                                  number_of_columns, chosen_arms_last_round,
+                                                                  database_size)
+        chosen_arm_ids = bandit.select_arm(context_vectors, t)
+        return Simulator.get_chosen_arms(index_arm_list, chosen_arm_ids)
+
 
 if __name__ == "__main__":
     # Running MAB
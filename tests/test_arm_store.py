@@ -0,0 +1,22 @@
+import bandits.bandit_arm_v1 as bandit_arm
+from bandits.bandit_arm_store_v1 import BanditArmStore
+from bandits.bandit_arm_v1 import BanditArm
+
+
+def test_chosen_payload_arm_is_not_evicted():
+    # a payload only arm is stored under an 'ixn_' id, but its index is named 'ix_' like the plain arm on the columns
+    store = BanditArmStore(max_age=0, max_memory=1e-9)
+    payload_arm_id = BanditArm.get_arm_id(('ss_item_sk',), 'store_sales', no_include=True)
+    payload_arm = BanditArm(('ss_item_sk',), 'store_sales', 1, 100)
+    store[payload_arm_id] = payload_arm
+    other_arm = BanditArm(('ss_store_sk',), 'store_sales', 1, 100)
+    store[BanditArm.get_arm_id(('ss_store_sk',), 'store_sales')] = other_arm
+    assert payload_arm_id != payload_arm.index_name
+
+    chosen_arms_last_round = {payload_arm.arm_index: payload_arm}
+    store.start_round(1, chosen_arms_last_round)
+
+    assert payload_arm_id in store
+    assert len(store) == 1
+    assert bandit_arm.arm_indexes[payload_arm.index_name] == payload_arm.arm_index
+    assert other_arm.index_name not in bandit_arm.arm_indexes
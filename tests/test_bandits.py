@@ -0,0 +1,160 @@
+import numpy
+import pytest
+import scipy.sparse
+
+import constants
+from bandits.bandit_c2ucb_v1 import C3UCB, C3UCBBank, C3UCBSlidingWindow, C3UCBSparse, LinTS
+
+CONTEXT_SIZE = 8
+HYPER_LAMBDA = 0.5
+
+
+class StubOracle:
+    """
+    Oracle that picks no arms, the tests only look at the upper bounds
+    """
+
+    def get_super_arm(self, upper_bounds, context_vectors, bandit_arms):
+        return []
+
+
+def get_batches(seed, round_count, context_size=CONTEXT_SIZE):
+    """
+    Random (context matrix, rewards) batches, small ones go through Woodbury and the last one is big enough to
+    refresh V inverse from V
+    """
+    random = numpy.random.default_rng(seed)
+    row_counts = [int(random.integers(1, 4)) for _ in range(round_count - 1)] + [context_size + 1]
+    return [(random.random((row_count, context_size)), random.random(row_count)) for row_count in row_counts]
+
+
+def get_direct_v(batches, context_size=CONTEXT_SIZE):
+    v = HYPER_LAMBDA * numpy.identity(context_size)
+    b = numpy.zeros((context_size, 1))
+    for context_matrix, rewards in batches:
+        v += context_matrix.transpose() @ context_matrix
+        b += (context_matrix.transpose() @ rewards).reshape(-1, 1)
+    return v, b
+
+
+def get_direct_upper_bounds(context_matrix, v, b, hyper_alpha):
+    v_inverse = numpy.linalg.inv(v)
+    weights = (v_inverse @ b)[:, 0]
+    creation_cost = context_matrix[:, 1] * weights[1]
+    confidence = numpy.sqrt(numpy.einsum('ij,jk,ik->i', context_matrix, v_inverse, context_matrix))
+    return (context_matrix @ weights - creation_cost + hyper_alpha * confidence +
+            creation_cost / constants.CREATION_COST_REDUCTION_FACTOR)
+
+
+@pytest.mark.parametrize('bandit_class', [C3UCB, C3UCBSparse])
+def test_rank_k_update_keeps_v_inverse(bandit_class):
+    bandit = bandit_class(CONTEXT_SIZE, 1, HYPER_LAMBDA, StubOracle())
+    batches = get_batches(0, 6)
+    for context_matrix, rewards in batches:
+        bandit.rank_k_update(bandit.get_context_matrix(scipy.sparse.csr_matrix(context_matrix))
+                             if bandit_class is C3UCBSparse else context_matrix, rewards)
+    v, b = get_direct_v(batches)
+
+    numpy.testing.assert_allclose(bandit.v, v)
+    numpy.testing.assert_allclose(bandit.b, b)
+    numpy.testing.assert_allclose(bandit.v_inverse, numpy.linalg.inv(v), atol=1e-10)
+
+    arm_contexts = numpy.random.default_rng(1).random((5, CONTEXT_SIZE))
+    bandit.set_arms([])
+    bandit.select_arm(scipy.sparse.csr_matrix(arm_contexts) if bandit_class is C3UCBSparse else arm_contexts, 0)
+    numpy.testing.assert_allclose(bandit.upper_bounds, get_direct_upper_bounds(arm_contexts, v, b, 1))
+
+
+def test_woodbury_downdate_removes_a_batch():
+    bandit = C3UCB(CONTEXT_SIZE, 1, HYPER_LAMBDA, StubOracle())
+    batches = get_batches(2, 5)[:-1]
+    for context_matrix, rewards in batches:
+        bandit.rank_k_update(context_matrix, rewards)
+    bandit.rank_k_update(*batches[1], sign=-1)
+    v, b = get_direct_v(batches[:1] + batches[2:])
+
+    numpy.testing.assert_allclose(bandit.v, v)
+    numpy.testing.assert_allclose(bandit.b, b, atol=1e-12)
+    numpy.testing.assert_allclose(bandit.v_inverse, numpy.linalg.inv(v), atol=1e-10)
+
+
+def test_sliding_window_keeps_the_last_rounds():
+    bandit = C3UCBSlidingWindow(CONTEXT_SIZE, 1, HYPER_LAMBDA, StubOracle(), window_size=3)
+    batches = get_batches(3, 7)[:-1]
+    for context_matrix, rewards in batches:
+        bandit.rank_k_update(context_matrix, rewards)
+        bandit.slide_window()
+    v, b = get_direct_v(batches[-3:])
+
+    numpy.testing.assert_allclose(bandit.v, v)
+    numpy.testing.assert_allclose(bandit.b, b, atol=1e-12)
+    numpy.testing.assert_allclose(bandit.v_inverse, numpy.linalg.inv(v), atol=1e-10)
+
+    restored = C3UCBSlidingWindow(CONTEXT_SIZE, 1, HYPER_LAMBDA, StubOracle(), window_size=3)
+    restored.set_state(bandit.get_state())
+    bandit.workload_change_trigger(0.4)
+    restored.workload_change_trigger(0.4)
+    v, b = get_direct_v(batches[-1:])
+    for window_bandit in (bandit, restored):
+        numpy.testing.assert_allclose(window_bandit.v, v)
+        numpy.testing.assert_allclose(window_bandit.v_inverse, numpy.linalg.inv(v), atol=1e-10)
+
+
+def test_lints_cholesky_factor_follows_v():
+    bandit = LinTS(CONTEXT_SIZE, 1, HYPER_LAMBDA, StubOracle(), seed=0)
+    batches = get_batches(4, 6)[:-1]
+    for context_matrix, rewards in batches:
+        bandit.rank_k_update(context_matrix, rewards)
+    bandit.rank_k_update(*batches[2], sign=-1)
+    v, b = get_direct_v(batches[:2] + batches[3:])
+
+    numpy.testing.assert_allclose(bandit.v, v)
+    numpy.testing.assert_allclose(bandit.v_cholesky, numpy.linalg.cholesky(v), atol=1e-10)
+    numpy.testing.assert_allclose(bandit.get_weight_vector(), numpy.linalg.solve(v, b), atol=1e-10)
+
+    restored = LinTS(CONTEXT_SIZE, 1, HYPER_LAMBDA, StubOracle(), seed=0)
+    restored.set_state(bandit.get_state())
+    bandit.random = numpy.random.default_rng(5)
+    restored.random = numpy.random.default_rng(5)
+    arm_contexts = numpy.random.default_rng(6).random((5, CONTEXT_SIZE))
+    numpy.testing.assert_allclose(restored.get_upper_bounds(arm_contexts, restored.get_weight_vector(), [1]),
+                                  bandit.get_upper_bounds(arm_contexts, bandit.get_weight_vector(), [1]))
+
+
+def test_state_round_trip_keeps_upper_bounds():
+    bandit = C3UCB(CONTEXT_SIZE, 1, HYPER_LAMBDA, StubOracle())
+    for context_matrix, rewards in get_batches(7, 4):
+        bandit.rank_k_update(context_matrix, rewards)
+    restored = C3UCB(CONTEXT_SIZE, 0, HYPER_LAMBDA, StubOracle())
+    restored.set_state(bandit.get_state())
+
+    arm_contexts = numpy.random.default_rng(8).random((5, CONTEXT_SIZE))
+    numpy.testing.assert_allclose(restored.get_arm_upper_bounds(arm_contexts),
+                                  bandit.get_arm_upper_bounds(arm_contexts))
+
+
+def test_bank_matches_direct_results():
+    context_sizes = [3, 5, 6, 7, 8, 17, 30]
+    bank = C3UCBBank(context_sizes, 1, HYPER_LAMBDA, [StubOracle() for _ in context_sizes])
+    random = numpy.random.default_rng(9)
+    played = [[] for _ in context_sizes]
+    for _ in range(4):
+        batches = [(random.random((int(random.integers(0, 4)), context_size)), None) for context_size in context_sizes]
+        batches = [(context_matrix, random.random(context_matrix.shape[0])) for context_matrix, _ in batches]
+        bank.rank_k_update(batches)
+        for i, batch in enumerate(batches):
+            played[i].append(batch)
+    bank.workload_change_trigger(0.2)
+
+    arm_contexts = [random.random((int(random.integers(0, 20)), context_size)) for context_size in context_sizes]
+    for member in bank.members:
+        member.set_arms([])
+    bank.select_arms(arm_contexts, 0)
+    for member, context_size, batches, contexts in zip(bank.members, context_sizes, played, arm_contexts):
+        v, b = get_direct_v(batches, context_size)
+        v = HYPER_LAMBDA * numpy.identity(context_size) + 0.6 * v
+        b = 0.6 * b
+        numpy.testing.assert_allclose(member.v, v)
+        numpy.testing.assert_allclose(member.b, b)
+        numpy.testing.assert_allclose(member.v_inverse, numpy.linalg.inv(v), atol=1e-10)
+        numpy.testing.assert_allclose(member.upper_bounds, get_direct_upper_bounds(contexts, v, b, 1))
@@ -0,0 +1,33 @@
+import numpy
+
+import bandits.checkpoint_v1 as checkpoint
+from bandits.arm_catalog_v1 import ArmCatalog
+from bandits.bandit_arm_store_v1 import BanditArmStore
+from bandits.bandit_arm_v1 import BanditArm
+from bandits.bandit_c2ucb_v1 import C3UCB
+from bandits.table_subset_index_v1 import TableSubsetIndex
+
+
+def test_checkpoint_keeps_shared_arms(tmp_path):
+    query_properties = {'tables': {}, 'joins': {}}
+    subset_index = TableSubsetIndex(query_properties)
+    arm_catalog = ArmCatalog(query_properties, subset_index)
+    arm_store = BanditArmStore()
+    arm = BanditArm(('ss_item_sk',), 'store_sales', 1, 100)
+    arm_store[BanditArm.get_arm_id(arm.index_cols, arm.table_name)] = arm
+    arm_catalog.index_arms[1] = ((), {arm.index_name: arm})
+    bandit = C3UCB(4, 1, 0.5, None)
+    bandit.rank_k_update(numpy.ones((2, 4)), numpy.ones(2))
+
+    file_path = str(tmp_path / 'checkpoint.npz')
+    checkpoint.save_checkpoint(file_path, 3, {'store_sales': bandit}, C3UCB(4, 1, 0.5, None),
+                               {'bandit_arm_store': arm_store, 'arm_catalog': arm_catalog,
+                                'subset_index': subset_index, 'column_selectivity': {('store_sales', 'ss_item_sk'): 0.1}})
+    current_round, bandit_states, simulation_state = checkpoint.load_checkpoint(file_path)
+
+    assert current_round == 3
+    numpy.testing.assert_array_equal(bandit_states['store_sales']['v'], bandit.v)
+    restored_arm = next(iter(simulation_state['bandit_arm_store'].values()))
+    assert simulation_state['arm_catalog'].index_arms[1][1][arm.index_name] is restored_arm
+    assert simulation_state['arm_catalog'].subset_index is simulation_state['subset_index']
+    assert simulation_state['column_selectivity'] == {('store_sales', 'ss_item_sk'): 0.1}
@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+
+import pytest
+
+import database.sql_helper_v3 as sql_helper
+from database.sql_connection_pool import SQLConnectionPool
+
+
+class StubCursor:
+    """
+    Cursor of a stub connection, a query sleeps for its latency and then returns its row count. A cancelled query
+    stops sleeping and raises, like a query cancelled on the server
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cancelled = threading.Event()
+        self.rows = None
+
+    def execute(self, query):
+        latency, rows = self.connection.queries[query]
+        with self.connection.lock:
+            self.connection.executed.append(query)
+        if self.cancelled.wait(latency):
+            raise Exception('Operation cancelled by user')
+        self.rows = rows
+
+    def fetchone(self):
+        return (self.rows,)
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class StubConnection:
+    """
+    Stub SQL connection, queries are a dict of query -> (latency in seconds, row count) shared by all connections
+    """
+
+    def __init__(self, queries, executed, lock):
+        self.queries = queries
+        self.executed = executed
+        self.lock = lock
+        self.timeout = 0
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def stub_database(monkeypatch):
+    """
+    Empty count cache that is never read from or written to disk, and a factory for stub connections
+    """
+    monkeypatch.setattr(sql_helper, 'count_numbers', {})
+    monkeypatch.setattr(sql_helper, 'load_count_cache', lambda connection: None)
+    executed = []
+    lock = threading.Lock()
+
+    def get_connection_factory(queries):
+        return lambda: StubConnection(queries, executed, lock)
+
+    return get_connection_factory, executed
+
+
+def get_count_queries(queries):
+    return {query: (query, False) for query in queries}
+
+
+def test_round_waits_on_the_slowest_count(stub_database):
+    get_connection_factory, executed = stub_database
+    queries = {f'count {i}': (0.5, i) for i in range(4)}
+    connection_pool = SQLConnectionPool(4, connection_factory=get_connection_factory(queries))
+    try:
+        start_time = time.monotonic()
+        row_counts = sql_helper.get_mv_row_counts(None, get_count_queries(queries), 0, connection_pool)
+        elapsed = time.monotonic() - start_time
+    finally:
+        connection_pool.close()
+
+    assert row_counts == {query: rows for query, (_, rows) in queries.items()}
+    assert elapsed < 1.5
+
+
+def test_count_past_the_deadline_is_cancelled(stub_database):
+    get_connection_factory, executed = stub_database
+    queries = {'count fast': (0.1, 10), 'count slow': (30, 20)}
+    connection_pool = SQLConnectionPool(2, connection_factory=get_connection_factory(queries))
+    try:
+        start_time = time.monotonic()
+        row_counts = sql_helper.get_mv_row_counts(None, get_count_queries(queries), 0.5, connection_pool)
+        elapsed = time.monotonic() - start_time
+    finally:
+        connection_pool.close()
+
+    assert row_counts == {'count fast': 10, 'count slow': -1}
+    assert elapsed < 5
+
+
+def test_shared_count_runs_once(stub_database):
+    get_connection_factory, executed = stub_database
+    queries = {'count store_sales': (0.1, 10), 'count catalog_sales': (0.1, 20)}
+    count_queries = {}
+    # join only views on the same fact tables share one count
+    for mv_query, count_query, fact_tables in [('view 1', 'count store_sales', ['store_sales']),
+                                               ('view 2', 'count store_sales', ['store_sales']),
+                                               ('view 3', 'count catalog_sales', ['catalog_sales'])]:
+        key, count_query_job = sql_helper.get_mv_count_query(mv_query, count_query, fact_tables, False)
+        count_queries[key] = count_query_job
+    connection_pool = SQLConnectionPool(2, connection_factory=get_connection_factory(queries))
+    try:
+        row_counts = sql_helper.get_mv_row_counts(None, count_queries, 5, connection_pool)
+        cached_row_counts = sql_helper.get_mv_row_counts(None, count_queries, 5, connection_pool)
+    finally:
+        connection_pool.close()
+
+    assert row_counts == {'store_sales': 10, 'catalog_sales': 20}
+    assert cached_row_counts == row_counts
+    assert sorted(executed) == ['count catalog_sales', 'count store_sales']
+
+
+def test_failed_count_is_not_saved(stub_database, monkeypatch, tmp_path):
+    get_connection_factory, executed = stub_database
+    count_cache_file = str(tmp_path / 'counts.json')
+    monkeypatch.setattr(sql_helper, 'count_cache_file', count_cache_file)
+    monkeypatch.setattr(sql_helper, 'count_cache_fingerprint', 'fingerprint')
+    queries = {'count fast': (0.1, 10), 'count slow': (30, 20)}
+    connection_pool = SQLConnectionPool(2, connection_factory=get_connection_factory(queries))
+    try:
+        sql_helper.get_mv_row_counts(None, get_count_queries(queries), 0.5, connection_pool)
+    finally:
+        connection_pool.close()
+    sql_helper.save_count_cache()
+
+    with open(count_cache_file) as f:
+        assert json.load(f) == {'fingerprint': 'fingerprint', 'counts': {'count fast': 10}}
+    # the failed count is not run again in the same run
+    assert sql_helper.count_numbers['count slow'] == -1
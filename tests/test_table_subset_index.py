@@ -0,0 +1,35 @@
+import types
+
+import numpy
+import pytest
+
+from bandits.table_subset_index_v1 import TableSubsetIndex
+
+
+def get_window(seed, query_count=30, table_count=7):
+    """
+    Random queries, each joins its tables in a random tree
+    """
+    random = numpy.random.default_rng(seed)
+    tables = [f'table_{i}' for i in range(table_count)]
+    query_properties = {'tables': {}, 'joins': {}}
+    query_objs = []
+    for query_id in range(query_count):
+        query_tables = list(random.choice(tables, int(random.integers(2, table_count)), replace=False))
+        query_properties['tables'][query_id] = query_tables
+        query_properties['joins'][query_id] = {(query_tables[i], query_tables[int(random.integers(i))]): []
+                                               for i in range(1, len(query_tables))}
+        query_objs.append(types.SimpleNamespace(id=query_id, original_running_time=float(random.random() * 10)))
+    return query_properties, query_objs
+
+
+@pytest.mark.parametrize('min_support', [0, 5, 20, 40, 80])
+def test_pruned_counts_keep_every_frequent_subset(min_support):
+    query_properties, query_objs = get_window(0)
+    subset_index = TableSubsetIndex(query_properties)
+    subset_index.update_window(query_objs)
+    subset_times = subset_index.count_table_subsets(query_objs)
+
+    assert subset_index.count_table_subsets(query_objs, min_support) == \
+           {table_subset: subset_time for table_subset, subset_time in subset_times.items()
+            if subset_time >= min_support}